@@ -0,0 +1,287 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import (
+    BotBlocked, ChatNotFound, UserDeactivated, BotKicked, CantInitiateConversation
+)
+
+from ratelimit import current_priority, BULK
+from database import (
+    get_broadcast_job, get_running_broadcast_jobs, save_broadcast_checkpoint,
+    set_broadcast_status, iter_user_ids, mark_users_inactive
+)
+
+# ==== SOZLAMALAR ====
+# Tezlik va RetryAfter'ni botning umumiy limiteri (ratelimit.py) boshqaradi
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "25"))        # parallel yuboruvchilar soni
+BROADCAST_CHECKPOINT_INTERVAL = float(os.getenv("BROADCAST_CHECKPOINT_INTERVAL", "5"))  # sekund
+
+# ==== NATIJA TURLARI ====
+SENT = "sent"
+BLOCKED = "blocked"
+NOT_FOUND = "not_found"
+ERROR = "error"
+
+
+# ==== HISOBOT ====
+class BroadcastStats:
+    def __init__(self, total: int = None, counts: dict = None):
+        self.total = total
+        self.counts = {SENT: 0, BLOCKED: 0, NOT_FOUND: 0, ERROR: 0}
+        self.counts.update(counts or {})
+        self.base = self.done  # davom ettirilgan joblarda oldingi natijalar tezlikka qo‘shilmaydi
+        self.started = time.monotonic()
+
+    @property
+    def done(self):
+        return sum(self.counts.values())
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.done - self.base) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        if not self.total or not self.rate:
+            return None
+        return max(self.total - self.done, 0) / self.rate
+
+    def format(self, title="📢 Habar yuborilmoqda...") -> str:
+        progress = f"{self.done}/{self.total}" if self.total else str(self.done)
+        eta = f"{int(self.eta // 60)} daq {int(self.eta % 60)} s" if self.eta is not None else "—"
+        return (
+            f"{title}\n\n"
+            f"📦 Jarayon: {progress}\n"
+            f"✅ Yuborildi: {self.counts[SENT]} ta\n"
+            f"🚫 Bloklagan: {self.counts[BLOCKED]} ta\n"
+            f"❓ Topilmadi: {self.counts[NOT_FOUND]} ta\n"
+            f"❌ Xatolik: {self.counts[ERROR]} ta\n"
+            f"⚡️ Tezlik: {self.rate:.1f} xabar/s\n"
+            f"⏳ Qolgan vaqt: {eta}"
+        )
+
+
+# ==== BITTA FOYDALANUVCHIGA YUBORISH ====
+async def send_one(bot, user_id: int, from_chat_id, message_id: int, mode: str = "forward") -> str:
+    try:
+        if mode == "copy":
+            await bot.copy_message(user_id, from_chat_id, message_id)
+        else:
+            await bot.forward_message(user_id, from_chat_id, message_id)
+        return SENT
+    except (BotBlocked, UserDeactivated, BotKicked, CantInitiateConversation):
+        return BLOCKED
+    except ChatNotFound:
+        return NOT_FOUND
+    except Exception as e:
+        # Limiter qayta urinishlarni tugatgandan keyingi RetryAfter ham shu yerga tushadi
+        print(f"[broadcast] {user_id} -> {e}")
+        return ERROR
+
+
+# ==== YUBORISH DVIGATELI ====
+async def _iterate(user_ids):
+    if hasattr(user_ids, "__aiter__"):
+        async for user_id in user_ids:
+            yield user_id
+    else:
+        for user_id in user_ids:
+            yield user_id
+
+
+async def run_broadcast(bot, user_ids, from_chat_id, message_id: int, mode: str = "forward",
+                        stats: BroadcastStats = None, on_result=None,
+                        workers: int = BROADCAST_WORKERS) -> BroadcastStats:
+    """`user_ids` (oddiy yoki async iterable) bo‘yicha parallel yuboradi.
+    `on_result(user_id, status)` har bir foydalanuvchi natijasi uchun chaqiriladi."""
+    stats = stats or BroadcastStats()
+    queue = asyncio.Queue(maxsize=workers * 4)
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                queue.task_done()
+                return
+            # Bitta foydalanuvchidagi xato worker'ni o‘ldirmasligi kerak - aks holda navbat bo‘shamaydi
+            try:
+                status = await send_one(bot, user_id, from_chat_id, message_id, mode)
+                stats.counts[status] += 1
+                if on_result:
+                    await on_result(user_id, status)
+            except Exception as e:
+                print(f"[broadcast] {user_id} natijasini qayta ishlashda xato -> {e}")
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        async for user_id in _iterate(user_ids):
+            await queue.put(user_id)
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return stats
+
+
+# ==== DOIMIY (RESUMABLE) JOBLAR ====
+_running_jobs = {}  # job_id -> asyncio.Event (to‘xtatish signali)
+
+
+class _Checkpoint:
+    """Parallel yuborishda ham aniq nazorat nuqtasi: `cursor` gacha hammasi bajarilgan,
+    `completed` esa cursor'dan keyin oldinroq tugaganlar"""
+
+    def __init__(self, cursor: int, done_ahead):
+        self.cursor = cursor
+        self.pending = deque()
+        self.completed = set(done_ahead)
+
+    def issue(self, user_id: int):
+        self.pending.append(user_id)
+
+    def complete(self, user_id: int):
+        self.completed.add(user_id)
+        while self.pending and self.pending[0] in self.completed:
+            self.cursor = self.pending.popleft()
+            self.completed.discard(self.cursor)
+
+    def snapshot(self):
+        return self.cursor, sorted(self.completed)
+
+
+def job_markup(job_id: int, status: str):
+    kb = InlineKeyboardMarkup(row_width=2)
+    if status == "running":
+        kb.add(
+            InlineKeyboardButton("⏸ Pauza", callback_data=f"bcast:pause:{job_id}"),
+            InlineKeyboardButton("⛔️ Bekor qilish", callback_data=f"bcast:cancel:{job_id}")
+        )
+    elif status == "paused":
+        kb.add(
+            InlineKeyboardButton("▶️ Davom ettirish", callback_data=f"bcast:resume:{job_id}"),
+            InlineKeyboardButton("⛔️ Bekor qilish", callback_data=f"bcast:cancel:{job_id}")
+        )
+    return kb
+
+
+JOB_TITLES = {
+    "running": "📢 Habar yuborilmoqda...",
+    "paused": "⏸ Habar yuborish to‘xtatildi.",
+    "cancelled": "⛔️ Habar yuborish bekor qilindi.",
+    "done": "🏁 Habar yuborish yakunlandi.",
+}
+
+
+async def _edit_job_message(bot, job: dict, text: str, markup=None):
+    if not job.get("status_message_id"):
+        return
+    try:
+        await bot.edit_message_text(text, job["admin_chat_id"], job["status_message_id"], reply_markup=markup)
+    except Exception as e:
+        print(f"[broadcast job {job['id']}] {e}")
+
+
+def stop_broadcast_job(job_id: int):
+    """Shu jarayonda ishlayotgan jobga to‘xtash signalini beradi"""
+    stop = _running_jobs.get(job_id)
+    if stop:
+        stop.set()
+
+
+async def run_broadcast_job(bot, job_id: int):
+    """Jobni bazadagi nazorat nuqtasidan boshlab (yoki davom ettirib) bajaradi"""
+    if job_id in _running_jobs:
+        return
+    # Job o‘z task'ida ishlaydi - undagi barcha yuborishlar faqat bo‘sh qolgan tezlikdan foydalanadi
+    current_priority.set(BULK)
+    stop = asyncio.Event()
+    _running_jobs[job_id] = stop
+    restart = False
+    try:
+        job = await get_broadcast_job(job_id)
+        if not job or job["status"] != "running":
+            return
+
+        stats = BroadcastStats(total=job["total"], counts={
+            SENT: job["sent"], BLOCKED: job["blocked"], NOT_FOUND: job["not_found"], ERROR: job["failed"]
+        })
+        checkpoint = _Checkpoint(job["cursor"], job["done_ahead"])
+        already_done = set(job["done_ahead"])
+
+        async def source():
+            async for user_id in iter_user_ids(after=job["cursor"], active_only=not job["include_inactive"]):
+                if stop.is_set():
+                    return
+                checkpoint.issue(user_id)
+                if user_id in already_done:
+                    checkpoint.complete(user_id)
+                    continue
+                yield user_id
+
+        dead = {BLOCKED: [], NOT_FOUND: []}
+
+        async def on_result(user_id, status):
+            if status in dead:
+                dead[status].append(user_id)
+            checkpoint.complete(user_id)
+
+        async def save():
+            # O‘lik chatlar nazorat nuqtasidan oldin yoziladi, shunda ular qayta yuborilmaydi
+            for status, user_ids in dead.items():
+                if user_ids:
+                    batch, dead[status] = user_ids, []
+                    await mark_users_inactive(batch, status)
+            cursor, done_ahead = checkpoint.snapshot()
+            return await save_broadcast_checkpoint(job_id, cursor, done_ahead, stats.counts)
+
+        async def checkpointer():
+            while True:
+                await asyncio.sleep(BROADCAST_CHECKPOINT_INTERVAL)
+                status = await save()
+                if status != "running":
+                    stop.set()
+                    return
+                await _edit_job_message(bot, job, stats.format(), job_markup(job_id, "running"))
+
+        saver = asyncio.create_task(checkpointer())
+        try:
+            await run_broadcast(bot, source(), job["from_chat"], job["message_id"], mode=job["mode"],
+                                stats=stats, on_result=on_result)
+        finally:
+            saver.cancel()
+
+        status = await save()
+        if status == "running" and stop.is_set():
+            # Pauza qilinib, bu job tugashidan oldin yana davom ettirilgan
+            restart = True
+            return
+        if status == "running":
+            await set_broadcast_status(job_id, "done")
+            status = "done"
+        await _edit_job_message(bot, job, stats.format(JOB_TITLES.get(status, "")), job_markup(job_id, status))
+        if status == "done":
+            await bot.send_message(
+                job["admin_chat_id"],
+                f"✅ Yuborildi: {stats.counts[SENT]} ta\n❌ Xatolik: {stats.done - stats.counts[SENT]} ta"
+            )
+    except Exception as e:
+        print(f"[broadcast job {job_id}] {e}")
+    finally:
+        _running_jobs.pop(job_id, None)
+        if restart:
+            asyncio.create_task(run_broadcast_job(bot, job_id))
+
+
+async def resume_broadcast_jobs(bot):
+    """Restartdan keyin tugallanmagan joblarni davom ettiradi"""
+    for job in await get_running_broadcast_jobs():
+        print(f"🔁 Broadcast job #{job['id']} davom ettirilmoqda (cursor={job['cursor']})")
+        asyncio.create_task(run_broadcast_job(bot, job["id"]))
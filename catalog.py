@@ -0,0 +1,61 @@
+import os
+from html import escape
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from cache import TTLCache
+from database import on_invalidate, get_kino_count, get_catalog_page, get_catalog_prev_cursor
+
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "50"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "600"))  # NOTIFY kelmay qolsa ham shuncha vaqtda yangilanadi
+
+# after -> (matn, JSON markup); "count" -> umumiy soni
+_page_cache = TTLCache(maxsize=1000, ttl=CATALOG_CACHE_TTL)
+
+# Istalgan kod qo‘shilsa/o‘chirilsa/o‘zgarsa sahifa chegaralari siljiydi - hammasi tashlanadi
+on_invalidate("kino", lambda code: _page_cache.clear())
+
+
+async def _count() -> int:
+    count = _page_cache.get("count")
+    if count is None:
+        count = await get_kino_count()
+        _page_cache.set("count", count)
+    return count
+
+
+async def _render(after: int):
+    rows = await get_catalog_page(after, CATALOG_PAGE_SIZE + 1)
+    if not rows:
+        return None
+    has_next = len(rows) > CATALOG_PAGE_SIZE
+    rows = rows[:CATALOG_PAGE_SIZE]
+
+    text = f"📄 <b>Barcha animelar</b> ({await _count()} ta):\n\n"
+    text += "".join(f"<code>{row['code']}</code> – <b>{escape(row['title'] or '')}</b>\n" for row in rows)
+
+    nav = []
+    if after > 0:
+        prev_after = await get_catalog_prev_cursor(rows[0]["code"], CATALOG_PAGE_SIZE)
+        nav.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"catalog:{prev_after}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"catalog:{rows[-1]['code']}"))
+    keyboard = InlineKeyboardMarkup()
+    if nav:
+        keyboard.row(*nav)
+    return text, keyboard.as_json()
+
+
+async def catalog_page(after: int = 0):
+    """(matn, markup) yoki katalog bo‘sh bo‘lsa None. Tayyor sahifalar keshdan olinadi"""
+    page = _page_cache.get(after)
+    if page is None:
+        page = await _render(after)
+        if page is None:
+            return None
+        _page_cache.set(after, page)
+    return page
+
+
+def catalog_cache_stats():
+    return _page_cache.stats()
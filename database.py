@@ -1,82 +1,402 @@
 import asyncpg
+import asyncio
+import json
 import os
+import random
+import secrets
 from dotenv import load_dotenv
 from datetime import date
 
+from cache import TTLCache
+
 load_dotenv()
 
 db_pool = None
 
+# === Katalog keshi (get_kino_by_code) ===
+KINO_CACHE_SIZE = int(os.getenv("KINO_CACHE_SIZE", "5000"))
+KINO_CACHE_TTL = float(os.getenv("KINO_CACHE_TTL", "3600"))
+KINO_CACHE_NEG_TTL = float(os.getenv("KINO_CACHE_NEG_TTL", "60"))  # mavjud bo‘lmagan kodlar uchun
+
+_kino_cache = TTLCache(maxsize=KINO_CACHE_SIZE, ttl=KINO_CACHE_TTL)
+_MISS = object()
+
+# === Statistika buferi (write-behind) ===
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "5"))  # sekund
+STATS_FLUSH_EVENTS = int(os.getenv("STATS_FLUSH_EVENTS", "500"))      # shuncha hodisadan keyin darhol
+
+_stat_buffer = {}    # (code, field) -> delta
+_stat_inflight = {}  # yozilayotgan (hali commit bo‘lmagan) deltalar
+_stat_events = 0
+_stats_lock = asyncio.Lock()
+_stats_task = None
+_stats_stop = None   # asyncio.Event - flusher'ni bekor qilmasdan to‘xtatish uchun
+
+# === Foydalanuvchi faolligi buferi (last_seen) ===
+USER_SEEN_THROTTLE = float(os.getenv("USER_SEEN_THROTTLE", "3600"))  # bitta foydalanuvchi shundan tez-tez yozilmaydi
+USER_SEEN_CACHE_SIZE = int(os.getenv("USER_SEEN_CACHE_SIZE", "100000"))
+
+_seen_recent = TTLCache(maxsize=USER_SEEN_CACHE_SIZE, ttl=USER_SEEN_THROTTLE)
+_seen_buffer = set()
+
+# === Kanallar ro‘yxati (xotiradagi nusxa) ===
+# 'sub' - majburiy obuna kanallari, 'main' - asosiy kanallar (post va konkurs uchun)
+DEFAULT_CHANNELS = {
+    "sub": ["@anilordtv"],
+    "main": ["@anilordtv"] + [c.strip() for c in (os.getenv("MAIN_CHANNELS") or "").split(",") if c.strip()],
+}
+_channels = {"sub": (), "main": ()}
+
+# === Adminlar (xotiradagi nusxa) ===
+DEFAULT_ADMINS = [7483732504]
+_admins = frozenset()
+
+# === Keshlarni boshqa instansiyalarda bekor qilish (LISTEN/NOTIFY) ===
+INVALIDATION_CHANNEL = os.getenv("INVALIDATION_CHANNEL", "cache_invalidation")
+INVALIDATION_PING = float(os.getenv("INVALIDATION_PING", "30"))  # ulanishni tekshirish oralig‘i (sekund)
+
+_invalidation_handlers = {}  # mavzu -> [callback(key)]; key=None - to‘liq qayta sinxronlash
+_bus_task = None
+
 # === Databasega ulanish ===
-async def init_db():
-    global db_pool
+async def init_db(migrate: bool = True):
+    """Pool'ni ochadi va xotiradagi nusxalarni yuklaydi. Ko‘p jarayonli rejimda sxema front jarayonda
+    bir marta yaratiladi (`migrate_db`), worker'lar esa `migrate=False` bilan chaqiradi."""
+    global db_pool, _stats_task, _stats_stop, _bus_task
     db_pool = await asyncpg.create_pool(
         dsn=os.getenv("DATABASE_URL"),
         statement_cache_size=0
     )
 
-    async with db_pool.acquire() as conn:
-        # === Foydalanuvchilar jadvali ===
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
+    if migrate:
+        async with db_pool.acquire() as conn:
+            await create_schema(conn)
+    await load_channels()
+    await load_admins()
+    _stats_stop = asyncio.Event()
+    _stats_task = asyncio.create_task(_stats_flusher())
+    _bus_task = asyncio.create_task(_invalidation_listener())
 
-        # === Kino/anime kodlari jadvali ===
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS kino_codes (
-                code SERIAL PRIMARY KEY,
-                title TEXT,
-                channel TEXT,
-                message_id INTEGER,
-                post_count INTEGER,
-                parts INTEGER,
-                status TEXT,
-                voice TEXT,
-                genres TEXT[],
-                video_file_id TEXT,
-                caption TEXT
-            );
-        """)
-
-        # === Statistika jadvali ===
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS stats (
-                code INTEGER PRIMARY KEY REFERENCES kino_codes(code) ON DELETE CASCADE,
-                searched INTEGER DEFAULT 0,
-                viewed INTEGER DEFAULT 0
-            );
-        """)
-
-        # === Adminlar jadvali ===
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                user_id BIGINT PRIMARY KEY
-            );
-        """)
-
-        # Dastlabki admin qo‘shish
-        default_admins = [7483732504]
-        for admin_id in default_admins:
-            await conn.execute(
-                "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
-                admin_id
-            )
+async def migrate_db():
+    """Sxema va boshlang‘ich ma'lumotlarni yaratadi - worker'lar fork qilinishidan oldin bir marta"""
+    conn = await asyncpg.connect(dsn=os.getenv("DATABASE_URL"), statement_cache_size=0)
+    try:
+        await create_schema(conn)
+    finally:
+        await conn.close()
+
+async def create_schema(conn):
+    # === Foydalanuvchilar jadvali ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    # Faollik holati: 'active' / 'blocked' (botni bloklagan) / 'not_found' (akkaunt yo‘q)
+    await conn.execute("""
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'active';
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP;
+        CREATE INDEX IF NOT EXISTS users_active_idx ON users (user_id) WHERE status = 'active';
+    """)
+
+    # === Kino/anime kodlari jadvali ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS kino_codes (
+            code SERIAL PRIMARY KEY,
+            title TEXT,
+            channel TEXT,
+            message_id INTEGER,
+            post_count INTEGER,
+            parts INTEGER,
+            status TEXT,
+            voice TEXT,
+            genres TEXT[],
+            video_file_id TEXT,
+            caption TEXT
+        );
+    """)
+
+    # === Statistika jadvali ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats (
+            code INTEGER PRIMARY KEY REFERENCES kino_codes(code) ON DELETE CASCADE,
+            searched INTEGER DEFAULT 0,
+            viewed INTEGER DEFAULT 0
+        );
+    """)
+
+    # === Adminlar jadvali ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            user_id BIGINT PRIMARY KEY
+        );
+    """)
+
+    # === Broadcast joblari (restartdan keyin davom ettirish uchun) ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id SERIAL PRIMARY KEY,
+            admin_chat_id BIGINT NOT NULL,
+            status_message_id INTEGER,
+            from_chat TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            mode TEXT NOT NULL DEFAULT 'forward',
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor BIGINT NOT NULL DEFAULT 0,
+            done_ahead BIGINT[] NOT NULL DEFAULT '{}',
+            include_inactive BOOLEAN NOT NULL DEFAULT FALSE,
+            total INTEGER,
+            sent INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            not_found INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    await conn.execute(
+        "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS include_inactive BOOLEAN NOT NULL DEFAULT FALSE"
+    )
+
+    # === Kanallar jadvali ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS channels (
+            kind TEXT NOT NULL CHECK (kind IN ('sub', 'main')),
+            username TEXT NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, username)
+        );
+    """)
+    # Jadval bo‘sh bo‘lsa (birinchi ishga tushirish) standart kanallar qo‘shiladi
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM channels)"):
+        await conn.executemany(
+            "INSERT INTO channels (kind, username) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+            [(kind, ch) for kind, chans in DEFAULT_CHANNELS.items() for ch in dict.fromkeys(chans)]
+        )
+
+    # === FSM holatlari (fsm_storage.PgStorage) ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            bucket JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        );
+    """)
+
+    # === Konkurslar ===
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS contests (
+            id SERIAL PRIMARY KEY,
+            active BOOLEAN NOT NULL DEFAULT TRUE,
+            post_ids JSONB NOT NULL DEFAULT '[]',
+            winners BIGINT[] NOT NULL DEFAULT '{}',
+            participant_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS contest_participants (
+            contest_id INTEGER NOT NULL REFERENCES contests(id) ON DELETE CASCADE,
+            user_id BIGINT NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (contest_id, user_id)
+        );
+    """)
+    # Har bir konkurs ichida zich tartib raqami (1..participant_count) - O(1) tasodifiy tanlash uchun
+    await conn.execute("ALTER TABLE contest_participants ADD COLUMN IF NOT EXISTS seq INTEGER")
+    await conn.execute("""
+        WITH numbered AS (
+            SELECT contest_id, user_id,
+                   row_number() OVER (PARTITION BY contest_id ORDER BY joined_at, user_id) AS rn
+            FROM contest_participants
+            WHERE contest_id IN (SELECT DISTINCT contest_id FROM contest_participants WHERE seq IS NULL)
+        )
+        UPDATE contest_participants p SET seq = numbered.rn
+        FROM numbered
+        WHERE p.contest_id = numbered.contest_id AND p.user_id = numbered.user_id
+    """)
+    await conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS contest_participants_seq_idx ON contest_participants (contest_id, seq)"
+    )
+    # G‘olib tanlashdan oldingi tekshiruv natijasi (NULL - hali tekshirilmagan)
+    await conn.execute("ALTER TABLE contest_participants ADD COLUMN IF NOT EXISTS eligible BOOLEAN")
+    await conn.execute("ALTER TABLE contest_participants ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP")
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS konkurs_draws (
+            id SERIAL PRIMARY KEY,
+            contest_id INTEGER NOT NULL REFERENCES contests(id) ON DELETE CASCADE,
+            place INTEGER NOT NULL,
+            user_id BIGINT NOT NULL,
+            seed BIGINT NOT NULL,
+            participant_count INTEGER NOT NULL,
+            attempts INTEGER NOT NULL,
+            drawn_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (contest_id, place)
+        );
+    """)
+    # Har bir urinish: seq, nomzod va tekshiruv natijasi - seed bilan birga tanlashni qayta tiklash uchun
+    await conn.execute(
+        "ALTER TABLE konkurs_draws ADD COLUMN IF NOT EXISTS attempt_log JSONB NOT NULL DEFAULT '[]'"
+    )
+
+    # Dastlabki admin faqat jadval bo‘sh bo‘lsa qo‘shiladi (o‘chirilgan admin restartda qaytmaydi)
+    if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM admins)"):
+        await conn.executemany(
+            "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
+            [(admin_id,) for admin_id in DEFAULT_ADMINS]
+        )
+
+async def close_db():
+    """Buferdagi statistikani yozib, pool'ni yopadi (shutdown paytida)"""
+    if _bus_task:
+        _bus_task.cancel()
+    if _stats_task:
+        # Bekor qilinmaydi: yozilayotgan deltalar yo‘qolmasligi uchun flusher o‘zi oxirgi marta yozib chiqadi
+        _stats_stop.set()
+        await _stats_task
+    await flush_stats()
+    await flush_seen_users()
+    await db_pool.close()
+
+# === Invalidation bus ===
+def on_invalidate(topic: str, callback):
+    """`topic` bo‘yicha bekor qilish xabarlariga obuna bo‘lish.
+    callback(key) oddiy yoki async bo‘lishi mumkin; key=None ulanish uzilgandan keyingi to‘liq resync"""
+    _invalidation_handlers.setdefault(topic, []).append(callback)
+
+async def notify_invalidation(topic: str, key=None):
+    """Barcha instansiyalarga (shu jumladan o‘ziga) kalit bo‘yicha bekor qilish xabarini yuboradi"""
+    payload = f"{topic}:{'' if key is None else key}"
+    try:
+        async with db_pool.acquire() as conn:
+            await conn.execute("SELECT pg_notify($1, $2)", INVALIDATION_CHANNEL, payload)
+    except Exception as e:
+        print(f"[notify] {payload} -> {e}")
+
+async def _dispatch_invalidation(topic: str, key):
+    for callback in _invalidation_handlers.get(topic, []):
+        try:
+            result = callback(key)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            print(f"[invalidate] {topic}:{key} -> {e}")
+
+async def _resync_all():
+    """Xabarlar o‘tkazib yuborilgan bo‘lishi mumkin - barcha keshlar qayta yuklanadi"""
+    for topic in list(_invalidation_handlers):
+        await _dispatch_invalidation(topic, None)
+
+async def _invalidation_listener():
+    """Alohida ulanishda LISTEN qiladi; uzilsa qayta ulanib, to‘liq resync qiladi"""
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=os.getenv("DATABASE_URL"), statement_cache_size=0)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _conn: lost.set())
+
+            def on_notify(_conn, _pid, _channel, payload):
+                topic, _, key = payload.partition(":")
+                asyncio.create_task(_dispatch_invalidation(topic, key or None))
+
+            await conn.add_listener(INVALIDATION_CHANNEL, on_notify)
+            # LISTEN o‘rnatilgandan keyin resync: oradagi o‘zgarishlar yo‘qolmaydi
+            await _resync_all()
+            delay = 1
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), timeout=INVALIDATION_PING)
+                except asyncio.TimeoutError:
+                    await asyncio.wait_for(conn.execute("SELECT 1"), timeout=10)
+            print("[invalidation] ulanish uzildi, qayta ulanamiz...")
+        except asyncio.CancelledError:
+            if conn:
+                await conn.close()
+            raise
+        except Exception as e:
+            print(f"[invalidation] {e}")
+        if conn and not conn.is_closed():
+            conn.terminate()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
 
 # === Foydalanuvchilar bilan ishlash ===
 async def add_user(user_id: int):
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO users (user_id) VALUES ($1) ON CONFLICT DO NOTHING", user_id
-        )
+        # Qaytib kelgan foydalanuvchi botni blokdan chiqargan bo‘ladi
+        await conn.execute("""
+            INSERT INTO users (user_id) VALUES ($1)
+            ON CONFLICT (user_id) DO UPDATE SET
+                last_seen = CURRENT_TIMESTAMP,
+                status = 'active',
+                blocked_at = NULL
+        """, user_id)
+    _seen_recent.set(user_id, True)
+
+def touch_user(user_id: int):
+    """Har bir update'da chaqiriladi (I/O yo‘q): foydalanuvchi USER_SEEN_THROTTLE ichida bir marta buferga tushadi,
+    `last_seen` va faol holat statistika flusher'i bilan birga bitta so‘rovda yoziladi"""
+    if _seen_recent.get(user_id) is None:
+        _seen_recent.set(user_id, True)
+        _seen_buffer.add(user_id)
+
+async def flush_seen_users():
+    global _seen_buffer
+    if not _seen_buffer:
+        return
+    user_ids, _seen_buffer = list(_seen_buffer), set()
+    written = False
+    try:
+        async with db_pool.acquire() as conn:
+            # Xabar yozayotgan foydalanuvchi botni bloklamagan - holati ham tiklanadi
+            await conn.execute("""
+                INSERT INTO users (user_id) SELECT unnest($1::bigint[])
+                ON CONFLICT (user_id) DO UPDATE SET
+                    last_seen = CURRENT_TIMESTAMP,
+                    status = 'active',
+                    blocked_at = NULL
+            """, user_ids)
+        written = True
+    except Exception as e:
+        print(f"[flush_seen_users] {e}")
+    finally:
+        if not written:
+            _seen_buffer.update(user_ids)
 
 async def get_user_count():
     async with db_pool.acquire() as conn:
         row = await conn.fetchrow("SELECT COUNT(*) FROM users")
         return row[0]
 
+async def get_active_user_count():
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT COUNT(*) FROM users WHERE status = 'active'")
+
+async def get_users_version():
+    """Eksport keshi uchun o‘zgarish belgisi: yangi foydalanuvchi, bloklash va qayta faollashish
+    (add_user / flush_seen_users / mark_users_inactive) vaqt belgilaridan birini oshiradi"""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT count(*), max(GREATEST(created_at, last_seen, blocked_at)) FROM users")
+    return tuple(row)
+
+async def mark_users_inactive(user_ids, status: str):
+    """Broadcast natijasida aniqlangan o‘lik chatlarni bitta so‘rov bilan belgilaydi"""
+    if not user_ids:
+        return
+    async with db_pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE users SET status = $2, blocked_at = CURRENT_TIMESTAMP
+            WHERE user_id = ANY($1::bigint[])
+        """, list(user_ids), status)
+
 async def get_today_users():
     async with db_pool.acquire() as conn:
         today = date.today()
@@ -86,11 +406,341 @@ async def get_today_users():
         return row[0] if row else 0
 
 async def get_all_user_ids():
+    return [user_id async for user_id in iter_user_ids()]
+
+USER_ID_BATCH = int(os.getenv("USER_ID_BATCH", "1000"))
+
+async def iter_user_id_batches(after: int = 0, batch_size: int = USER_ID_BATCH, active_only: bool = False):
+    """user_id'larni keyset pagination bilan partiyalab beradi (xotira doimiy)"""
+    query = "SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2"
+    if active_only:
+        query = "SELECT user_id FROM users WHERE user_id > $1 AND status = 'active' ORDER BY user_id LIMIT $2"
+    while True:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(query, after, batch_size)
+        if not rows:
+            return
+        batch = [row["user_id"] for row in rows]
+        yield batch
+        if len(batch) < batch_size:
+            return
+        after = batch[-1]
+
+async def iter_user_ids(after: int = 0, batch_size: int = USER_ID_BATCH, active_only: bool = False):
+    async for batch in iter_user_id_batches(after, batch_size, active_only):
+        for user_id in batch:
+            yield user_id
+
+async def iter_user_rows(batch_size: int = USER_ID_BATCH):
+    """(user_id, status, created_at) - eksport uchun, keyset pagination bilan"""
+    after = 0
+    while True:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT user_id, status, created_at FROM users
+                WHERE user_id > $1 ORDER BY user_id LIMIT $2
+            """, after, batch_size)
+        for row in rows:
+            yield tuple(row)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]["user_id"]
+
+# === Broadcast joblari ===
+async def create_broadcast_job(admin_chat_id: int, from_chat: str, message_id: int, mode: str, total: int,
+                               include_inactive: bool = False):
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("""
+            INSERT INTO broadcast_jobs (admin_chat_id, from_chat, message_id, mode, total, include_inactive)
+            VALUES ($1, $2, $3, $4, $5, $6) RETURNING id
+        """, admin_chat_id, from_chat, message_id, mode, total, include_inactive)
+
+async def set_broadcast_status_message(job_id: int, status_message_id: int):
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE broadcast_jobs SET status_message_id = $2 WHERE id = $1", job_id, status_message_id
+        )
+
+async def get_broadcast_job(job_id: int):
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM broadcast_jobs WHERE id = $1", job_id)
+        return dict(row) if row else None
+
+async def get_running_broadcast_jobs():
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+        return [dict(r) for r in rows]
+
+async def save_broadcast_checkpoint(job_id: int, cursor: int, done_ahead, counts: dict):
+    """Nazorat nuqtasini saqlaydi va jobning joriy holatini qaytaradi (pauza/bekor qilishni bilish uchun)"""
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("""
+            UPDATE broadcast_jobs
+            SET cursor = $2, done_ahead = $3, sent = $4, blocked = $5, not_found = $6, failed = $7,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1
+            RETURNING status
+        """, job_id, cursor, list(done_ahead), counts["sent"], counts["blocked"], counts["not_found"], counts["error"])
+
+async def set_broadcast_status(job_id: int, status: str):
+    """Faqat tugallanmagan joblar holatini o‘zgartiradi. O‘zgargan bo‘lsa True"""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            UPDATE broadcast_jobs SET status = $2, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $1 AND status IN ('running', 'paused')
+            RETURNING id
+        """, job_id, status)
+        return row is not None
+
+# === Konkurslar bilan ishlash ===
+def _contest(row):
+    if not row:
+        return None
+    contest = dict(row)
+    contest["post_ids"] = json.loads(contest["post_ids"])
+    contest["winners"] = list(contest["winners"])
+    return contest
+
+async def create_contest() -> int:
+    """Yangi konkurs ochadi (bir nechta konkurs bir vaqtda faol bo‘lishi mumkin)"""
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("INSERT INTO contests DEFAULT VALUES RETURNING id")
+
+async def get_contest(contest_id: int):
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM contests WHERE id = $1", contest_id)
+    return _contest(row)
+
+async def get_current_contest():
+    """Eng oxirgi faol konkurs (eski `?start=konkurs` havolalari uchun)"""
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT * FROM contests WHERE active ORDER BY id DESC LIMIT 1")
+    return _contest(row)
+
+async def list_contests(limit: int = 10):
+    """Faol konkurslar va oxirgi yakunlanganlar"""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch("SELECT * FROM contests ORDER BY active DESC, id DESC LIMIT $1", limit)
+    return [_contest(row) for row in rows]
+
+async def set_contest_active(contest_id: int, active: bool):
+    async with db_pool.acquire() as conn:
+        await conn.execute("UPDATE contests SET active = $2 WHERE id = $1", contest_id, active)
+
+async def add_contest_post(contest_id: int, chat, message_id: int):
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE contests SET post_ids = post_ids || $2::jsonb WHERE id = $1",
+            contest_id, json.dumps([{"chat": chat, "message_id": message_id}])
+        )
+
+async def join_contest(contest_id: int, user_id: int) -> bool:
+    """Qo‘shilsa True, oldin qo‘shilgan bo‘lsa False. Hisoblagich va tartib raqami (seq) bitta so‘rovda beriladi -
+    konkurs qatori faqat shu so‘rov davomida band bo‘ladi. Bir foydalanuvchi bir vaqtda ikki marta bossa
+    seq'da bo‘shliq qolishi mumkin - tanlash buni rad etish orqali o‘tkazib yuboradi."""
     async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id FROM users")
-        return [row["user_id"] for row in rows]
+        inserted = await conn.fetchval("""
+            WITH c AS (
+                UPDATE contests SET participant_count = participant_count + 1
+                WHERE id = $1 AND NOT EXISTS (
+                    SELECT 1 FROM contest_participants WHERE contest_id = $1 AND user_id = $2
+                )
+                RETURNING participant_count
+            )
+            INSERT INTO contest_participants (contest_id, user_id, seq)
+            SELECT $1, $2, participant_count FROM c
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        """, contest_id, user_id)
+    return inserted is not None
+
+DRAW_MAX_ATTEMPTS = int(os.getenv("DRAW_MAX_ATTEMPTS", "64"))
+VERDICT_TTL = float(os.getenv("KONKURS_VERDICT_TTL", "600"))  # tekshiruv natijasi shuncha vaqt amal qiladi (sekund)
+
+async def save_participant_verdicts(contest_id: int, verdicts):
+    """[(user_id, eligible), ...] ni bitta so‘rov bilan yozadi"""
+    if not verdicts:
+        return
+    async with db_pool.acquire() as conn:
+        await conn.execute("""
+            UPDATE contest_participants p
+            SET eligible = v.eligible, checked_at = CURRENT_TIMESTAMP
+            FROM unnest($2::BIGINT[], $3::BOOLEAN[]) AS v(user_id, eligible)
+            WHERE p.contest_id = $1 AND p.user_id = v.user_id
+        """, contest_id, [user_id for user_id, _ in verdicts], [eligible for _, eligible in verdicts])
+
+async def get_eligibility_counts(contest_id: int, ttl: float = VERDICT_TTL) -> dict:
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT
+                count(*) FILTER (WHERE fresh AND eligible) AS eligible,
+                count(*) FILTER (WHERE fresh AND NOT eligible) AS ineligible,
+                count(*) FILTER (WHERE NOT fresh) AS unchecked
+            FROM (
+                SELECT eligible, COALESCE(checked_at > CURRENT_TIMESTAMP - make_interval(secs => $2), FALSE) AS fresh
+                FROM contest_participants WHERE contest_id = $1
+            ) t
+        """, contest_id, ttl)
+    return dict(row)
+
+async def draw_contest_winner(contest_id: int, exclude=(), seed: int = None, verify=None, ttl: float = VERDICT_TTL,
+                              max_winners: int = None):
+    """G‘olibni tanlaydi: 1..participant_count dan tasodifiy seq olinadi, oldingi g‘oliblar, `exclude` va
+    yaroqsiz deb topilganlar rad etiladi (rejection sampling, o‘rtacha O(1)).
+    `verify(user_id)` berilsa, natijasi eskirgan nomzod qayta tekshiriladi. Tanlash va tekshiruv tranzaksiyadan
+    tashqarida bo‘ladi (Telegram so‘rovlari paytida konkurs qatori qulflanmaydi), natija esa qisqa tranzaksiyada
+    qayta tekshirilib seed va urinishlar jurnali bilan `konkurs_draws` ga yoziladi.
+    Qaytaradi: {"user_id", "place", "seed", "attempts"}; nomzod qolmasa yoki `max_winners` to‘lgan bo‘lsa None."""
+    seed = secrets.randbits(63) if seed is None else seed
+    rng = random.Random(seed)
+    async with db_pool.acquire() as conn:
+        contest = await conn.fetchrow("SELECT participant_count, winners FROM contests WHERE id = $1", contest_id)
+    if not contest:
+        return None
+    total = contest["participant_count"]
+    rejected = set(contest["winners"]) | set(exclude)
+    winner = None
+    attempts = 0
+    attempt_log = []  # [seq, user_id, eligible, manba] - manba: "cache" / "verify" / "rejected" / None
+    while attempts < DRAW_MAX_ATTEMPTS and total:
+        attempts += 1
+        seq = rng.randint(1, total)
+        async with db_pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT user_id, eligible,
+                       COALESCE(checked_at > CURRENT_TIMESTAMP - make_interval(secs => $3), FALSE) AS fresh
+                FROM contest_participants WHERE contest_id = $1 AND seq = $2
+            """, contest_id, seq, ttl)
+        if row is None:
+            attempt_log.append([seq, None, None, None])
+            continue
+        if row["user_id"] in rejected:
+            attempt_log.append([seq, row["user_id"], None, "rejected"])
+            continue
+        eligible = row["eligible"] if row["fresh"] else None
+        source = "cache" if eligible is not None else None
+        if eligible is None and verify:
+            eligible = await verify(row["user_id"])
+            source = "verify"
+            if eligible is not None:
+                await save_participant_verdicts(contest_id, [(row["user_id"], eligible)])
+        attempt_log.append([seq, row["user_id"], eligible, source])
+        if eligible is False:
+            rejected.add(row["user_id"])
+            continue
+        winner = row["user_id"]
+        break
+    if winner is None and total:
+        # Deyarli hamma rad etilgan: qolganlar orasidan (seed bo‘yicha takrorlanadigan) tanlash
+        async with db_pool.acquire() as conn:
+            remaining = await conn.fetchval("""
+                SELECT count(*) FROM contest_participants
+                WHERE contest_id = $1 AND user_id <> ALL($2::BIGINT[]) AND eligible IS NOT FALSE
+            """, contest_id, list(rejected))
+            if remaining:
+                offset = rng.randrange(remaining)
+                winner = await conn.fetchval("""
+                    SELECT user_id FROM contest_participants
+                    WHERE contest_id = $1 AND user_id <> ALL($2::BIGINT[]) AND eligible IS NOT FALSE
+                    ORDER BY seq OFFSET $3 LIMIT 1
+                """, contest_id, list(rejected), offset)
+                attempt_log.append(["fallback", winner, remaining, offset])
+    if winner is None:
+        return None
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            # Parallel tanlash shu orada g‘olib qo‘shgan bo‘lishi mumkin - qulf ostida qayta tekshiriladi
+            winners = await conn.fetchval("SELECT winners FROM contests WHERE id = $1 FOR UPDATE", contest_id)
+            if winners is None or winner in winners:
+                return None
+            if max_winners is not None and len(winners) >= max_winners:
+                return None
+            place = len(winners) + 1
+            await conn.execute("""
+                INSERT INTO konkurs_draws (contest_id, place, user_id, seed, participant_count, attempts, attempt_log)
+                VALUES ($1, $2, $3, $4, $5, $6, $7::jsonb)
+            """, contest_id, place, winner, seed, total, attempts, json.dumps(attempt_log))
+            await conn.execute(
+                "UPDATE contests SET winners = array_append(winners, $2) WHERE id = $1", contest_id, winner
+            )
+    return {"user_id": winner, "place": place, "seed": seed, "attempts": attempts}
+
+async def iter_contest_participants(contest_id: int, batch_size: int = USER_ID_BATCH, stale_after: float = None):
+    """`stale_after` berilsa faqat tekshirilmagan yoki natijasi shuncha sekunddan eski bo‘lganlar"""
+    query = """
+        SELECT user_id FROM contest_participants
+        WHERE contest_id = $1 AND user_id > $2 ORDER BY user_id LIMIT $3
+    """
+    args = ()
+    if stale_after is not None:
+        query = """
+            SELECT user_id FROM contest_participants
+            WHERE contest_id = $1 AND user_id > $2
+              AND (checked_at IS NULL OR checked_at < CURRENT_TIMESTAMP - make_interval(secs => $4))
+            ORDER BY user_id LIMIT $3
+        """
+        args = (stale_after,)
+    after = 0
+    while True:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch(query, contest_id, after, batch_size, *args)
+        for row in rows:
+            yield row["user_id"]
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]["user_id"]
+
+async def iter_contest_participant_rows(contest_id: int, batch_size: int = USER_ID_BATCH):
+    """(seq, user_id, joined_at) - qo‘shilish tartibida, keyset pagination bilan"""
+    after = 0
+    while True:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT seq, user_id, joined_at FROM contest_participants
+                WHERE contest_id = $1 AND seq > $2 ORDER BY seq LIMIT $3
+            """, contest_id, after, batch_size)
+        for row in rows:
+            yield tuple(row)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]["seq"]
+
+async def import_contest(active: bool, post_ids, winners, participants) -> int:
+    """Eski JSON fayllardagi konkursni bazaga ko‘chirish uchun"""
+    async with db_pool.acquire() as conn:
+        async with conn.transaction():
+            contest_id = await conn.fetchval(
+                "INSERT INTO contests (active, post_ids, winners) VALUES ($1, $2::jsonb, $3) RETURNING id",
+                active, json.dumps(post_ids), list(winners)
+            )
+            await conn.executemany(
+                "INSERT INTO contest_participants (contest_id, user_id, seq) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
+                [(contest_id, user_id, seq) for seq, user_id in enumerate(dict.fromkeys(participants), 1)]
+            )
+            await conn.execute("""
+                UPDATE contests SET participant_count =
+                    (SELECT count(*) FROM contest_participants WHERE contest_id = $1)
+                WHERE id = $1
+            """, contest_id)
+    return contest_id
 
 # === Kodlar bilan ishlash ===
+def _code_key(code):
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+def invalidate_kino(*codes):
+    for code in codes:
+        _kino_cache.pop(_code_key(code))
+
+def clear_kino_cache():
+    _kino_cache.clear()
+
+def kino_cache_stats():
+    return _kino_cache.stats()
+
 async def add_kino_code(code, channel, message_id, post_count, title, parts=None, status=None, voice=None, genres=None, video_file_id=None, caption=None):
     async with db_pool.acquire() as conn:
         await conn.execute("""
@@ -114,27 +764,85 @@ async def add_kino_code(code, channel, message_id, post_count, title, parts=None
             INSERT INTO stats (code) VALUES ($1)
             ON CONFLICT DO NOTHING
         """, code)
+    invalidate_kino(code)
+    await notify_invalidation("kino", code)
 
-async def get_kino_by_code(code):
-    async with db_pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT * FROM kino_codes WHERE code=$1", code)
-        return dict(row) if row else None
+def _on_kino_invalidated(code):
+    if code is None:
+        clear_kino_cache()
+    else:
+        invalidate_kino(code)
 
-async def get_all_codes():
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("SELECT * FROM kino_codes ORDER BY code")
-        return [dict(r) for r in rows]
+on_invalidate("kino", _on_kino_invalidated)
+
+async def get_kino_by_code(code):
+    key = _code_key(code)
+    if key is None:
+        return None
+    row = _kino_cache.get(key, _MISS)
+    if row is _MISS:
+        async with db_pool.acquire() as conn:
+            record = await conn.fetchrow("SELECT * FROM kino_codes WHERE code=$1", key)
+        row = dict(record) if record else None
+        _kino_cache.set(key, row, ttl=None if row else KINO_CACHE_NEG_TTL)
+    return dict(row) if row else None
 
 async def delete_kino_code(code):
+    key = _code_key(code)
+    if key is None:
+        return False
     async with db_pool.acquire() as conn:
-        result = await conn.execute("DELETE FROM kino_codes WHERE code = $1", code)
-        return result.endswith("1")
+        result = await conn.execute("DELETE FROM kino_codes WHERE code = $1", key)
+    invalidate_kino(key)
+    await notify_invalidation("kino", key)
+    return result.endswith("1")
 
 async def update_anime_code(old_code, new_code, new_title):
+    old_key, new_key = _code_key(old_code), _code_key(new_code)
+    if old_key is None or new_key is None:
+        raise ValueError("Kod raqam bo‘lishi kerak")
     async with db_pool.acquire() as conn:
         await conn.execute("""
             UPDATE kino_codes SET code = $1, title = $2 WHERE code = $3
-        """, new_code, new_title, old_code)
+        """, new_key, new_title, old_key)
+    invalidate_kino(old_key, new_key)
+    await notify_invalidation("kino", old_key)
+    await notify_invalidation("kino", new_key)
+
+async def iter_catalog(batch_size: int = USER_ID_BATCH):
+    """(code, title, post_count, status, voice, genres) - caption'siz, keyset pagination bilan"""
+    after = 0
+    while True:
+        async with db_pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT code, title, post_count, status, voice, genres FROM kino_codes
+                WHERE code > $1 ORDER BY code LIMIT $2
+            """, after, batch_size)
+        for row in rows:
+            yield tuple(row)
+        if len(rows) < batch_size:
+            return
+        after = rows[-1]["code"]
+
+async def get_kino_count() -> int:
+    async with db_pool.acquire() as conn:
+        return await conn.fetchval("SELECT count(*) FROM kino_codes")
+
+async def get_catalog_page(after: int, limit: int):
+    """Keyset: `after` dan keyingi `limit` ta kod (faqat code va title)"""
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT code, title FROM kino_codes WHERE code > $1 ORDER BY code LIMIT $2", after, limit
+        )
+    return [dict(r) for r in rows]
+
+async def get_catalog_prev_cursor(first_code: int, limit: int) -> int:
+    """`first_code` dan oldingi sahifaning `after` kursori (birinchi sahifa uchun 0)"""
+    async with db_pool.acquire() as conn:
+        code = await conn.fetchval(
+            "SELECT code FROM kino_codes WHERE code < $1 ORDER BY code DESC OFFSET $2 LIMIT 1", first_code, limit
+        )
+    return code or 0
 
 async def get_last_anime_code():
     async with db_pool.acquire() as conn:
@@ -143,30 +851,148 @@ async def get_last_anime_code():
 
 # === Statistika bilan ishlash ===
 async def increment_stat(code, field):
+    global _stat_events
     if field not in ("searched", "viewed"):
         return
-    async with db_pool.acquire() as conn:
-        await conn.execute(f"""
-            UPDATE stats SET {field} = {field} + 1 WHERE code = $1
-        """, code)
+    key = _code_key(code)
+    if key is None:
+        return
+    _stat_buffer[(key, field)] = _stat_buffer.get((key, field), 0) + 1
+    _stat_events += 1
+    if _stat_events >= STATS_FLUSH_EVENTS and not _stats_lock.locked():
+        _stat_events = 0
+        asyncio.create_task(flush_stats())
+
+async def flush_stats():
+    """Yig‘ilgan deltalarni bitta UPDATE bilan bazaga yozadi"""
+    global _stat_buffer, _stat_inflight, _stat_events
+    async with _stats_lock:
+        if not _stat_buffer:
+            return
+        _stat_inflight, _stat_buffer, _stat_events = _stat_buffer, {}, 0
+
+        per_code = {}
+        for (code, field), delta in _stat_inflight.items():
+            per_code.setdefault(code, {"searched": 0, "viewed": 0})[field] += delta
+        codes = list(per_code)
+        written = False
+        try:
+            async with db_pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE stats AS s
+                    SET searched = s.searched + d.searched,
+                        viewed = s.viewed + d.viewed
+                    FROM unnest($1::int[], $2::int[], $3::int[]) AS d(code, searched, viewed)
+                    WHERE s.code = d.code
+                """, codes, [per_code[c]["searched"] for c in codes], [per_code[c]["viewed"] for c in codes])
+            written = True
+        except Exception as e:
+            print(f"[flush_stats] {e}")
+        finally:
+            # Yozilmagan deltalarni (xato yoki bekor qilish) keyingi urinish uchun qaytaramiz
+            if not written:
+                for key, delta in _stat_inflight.items():
+                    _stat_buffer[key] = _stat_buffer.get(key, 0) + delta
+            _stat_inflight = {}
+
+async def _stats_flusher():
+    while not _stats_stop.is_set():
+        try:
+            await asyncio.wait_for(_stats_stop.wait(), STATS_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush_stats()
+        await flush_seen_users()
+
+def _pending_stat(code, field):
+    return _stat_buffer.get((code, field), 0) + _stat_inflight.get((code, field), 0)
 
 async def get_code_stat(code):
+    key = _code_key(code)
+    if key is None:
+        return None
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT searched, viewed FROM stats WHERE code = $1", key)
+    if not row:
+        return None
+    return {
+        "searched": (row["searched"] or 0) + _pending_stat(key, "searched"),
+        "viewed": (row["viewed"] or 0) + _pending_stat(key, "viewed"),
+    }
+
+# === Kanallar bilan ishlash ===
+def get_channels(kind: str) -> tuple:
+    """Xotiradagi nusxadan o‘qiydi (bazaga murojaat qilmaydi)"""
+    return _channels[kind]
+
+async def load_channels():
+    global _channels
     async with db_pool.acquire() as conn:
-        return await conn.fetchrow("SELECT searched, viewed FROM stats WHERE code = $1", code)
+        rows = await conn.fetch("SELECT kind, username FROM channels ORDER BY added_at, username")
+    snapshot = {"sub": [], "main": []}
+    for row in rows:
+        snapshot[row["kind"]].append(row["username"])
+    _channels = {kind: tuple(chans) for kind, chans in snapshot.items()}
+
+on_invalidate("channels", lambda username: load_channels())
+
+async def add_channel(kind: str, username: str) -> bool:
+    async with db_pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            INSERT INTO channels (kind, username) VALUES ($1, $2)
+            ON CONFLICT DO NOTHING RETURNING username
+        """, kind, username)
+    await load_channels()
+    if row is not None:
+        await notify_invalidation("channels", username)
+    return row is not None
+
+async def remove_channel(kind: str, username: str) -> bool:
+    async with db_pool.acquire() as conn:
+        result = await conn.execute("DELETE FROM channels WHERE kind = $1 AND username = $2", kind, username)
+    await load_channels()
+    removed = result.endswith("1")
+    if removed:
+        await notify_invalidation("channels", username)
+    return removed
 
 # === Adminlar bilan ishlash ===
+def is_admin(user_id: int) -> bool:
+    """Har bir update'da chaqiriladi - faqat xotiradagi to‘plam tekshiriladi"""
+    return user_id in _admins
+
+def get_admins() -> frozenset:
+    return _admins
+
+async def load_admins():
+    global _admins
+    _admins = frozenset(await get_all_admins())
+
+on_invalidate("admins", lambda user_id: load_admins())
+
 async def get_all_admins():
     async with db_pool.acquire() as conn:
         rows = await conn.fetch("SELECT user_id FROM admins")
         return {row["user_id"] for row in rows}
 
-async def add_admin(user_id: int):
+async def add_admin(user_id: int) -> bool:
+    global _admins
     async with db_pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
+        row = await conn.fetchrow(
+            "INSERT INTO admins (user_id) VALUES ($1) ON CONFLICT DO NOTHING RETURNING user_id",
             user_id
         )
+    _admins = _admins | {user_id}
+    if row is not None:
+        await notify_invalidation("admins", user_id)
+    return row is not None
 
-async def remove_admin(user_id: int):
+async def remove_admin(user_id: int) -> bool:
+    global _admins
     async with db_pool.acquire() as conn:
-        await conn.execute("DELETE FROM admins WHERE user_id = $1", user_id)
+        result = await conn.execute("DELETE FROM admins WHERE user_id = $1", user_id)
+    _admins = _admins - {user_id}
+    removed = result.endswith("1")
+    if removed:
+        await notify_invalidation("admins", user_id)
+    return removed
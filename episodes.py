@@ -0,0 +1,88 @@
+import os
+import json
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from cache import TTLCache
+from database import on_invalidate, _code_key
+
+COPY_MESSAGES_LIMIT = 100                               # copyMessages bir chaqiruvda 100 tagacha xabar
+EPISODE_RANGE = int(os.getenv("EPISODE_RANGE", "10"))   # "1–10" kabi oraliq tugmalari hajmi
+EPISODES_PER_PAGE = int(os.getenv("EPISODES_PER_PAGE", "50"))  # Telegram: klaviaturada 100 tagacha tugma
+MARKUP_CACHE_SIZE = int(os.getenv("MARKUP_CACHE_SIZE", "2000"))
+MARKUP_CACHE_TTL = float(os.getenv("MARKUP_CACHE_TTL", str(24 * 3600)))
+
+# (normallashgan code, post_count, page) -> tayyor JSON markup (aiogram uni reply_markup sifatida o‘zgartirmasdan yuboradi)
+_markup_cache = TTLCache(maxsize=MARKUP_CACHE_SIZE, ttl=MARKUP_CACHE_TTL)
+
+
+def invalidate_episode_markup(code=None):
+    if code is None:
+        _markup_cache.clear()
+    else:
+        key = _code_key(code)
+        _markup_cache.drop_where(lambda k: k[0] == key)
+
+
+# add_kino_code / delete / update_anime_code (istalgan instansiyada) - shu kod sahifalari tashlanadi
+on_invalidate("kino", invalidate_episode_markup)
+
+
+# === Qismlar klaviaturasi ===
+def page_count(post_count: int) -> int:
+    return max(1, -(-post_count // EPISODES_PER_PAGE))
+
+
+def _build_keyboard(code, post_count: int, page: int) -> InlineKeyboardMarkup:
+    first = (page - 1) * EPISODES_PER_PAGE + 1
+    last = min(page * EPISODES_PER_PAGE, post_count)
+    keyboard = InlineKeyboardMarkup(row_width=5)
+    keyboard.add(*[InlineKeyboardButton(str(i), callback_data=f"kino:{code}:{i}") for i in range(first, last + 1)])
+    if post_count > EPISODE_RANGE:
+        keyboard.add(*[
+            InlineKeyboardButton(f"{start}–{min(start + EPISODE_RANGE - 1, last)}",
+                                 callback_data=f"kinor:{code}:{start}:{min(start + EPISODE_RANGE - 1, last)}")
+            for start in range(first, last + 1, EPISODE_RANGE)
+        ])
+    pages = page_count(post_count)
+    if pages > 1:
+        keyboard.row(
+            InlineKeyboardButton("⬅️", callback_data=f"kpage:{code}:{pages if page == 1 else page - 1}"),
+            InlineKeyboardButton(f"{page}/{pages}", callback_data=f"kpage:{code}:{page}"),
+            InlineKeyboardButton("➡️", callback_data=f"kpage:{code}:{1 if page == pages else page + 1}")
+        )
+    if post_count > 1:
+        keyboard.row(InlineKeyboardButton(f"📥 Hammasini yuborish (1–{post_count})",
+                                          callback_data=f"kinor:{code}:1:{post_count}"))
+    return keyboard
+
+
+def episode_keyboard(code, post_count: int, page: int = 1) -> str:
+    """Sahifa klaviaturasini JSON ko‘rinishida qaytaradi; har bir (kod, sahifa) faqat bir marta quriladi"""
+    page = min(max(page, 1), page_count(post_count))
+    key = (_code_key(code), post_count, page)  # "007" va "7" bitta yozuv
+    markup = _markup_cache.get(key)
+    if markup is None:
+        markup = _build_keyboard(code, post_count, page).as_json()
+        _markup_cache.set(key, markup)
+    return markup
+
+
+def markup_cache_stats():
+    return _markup_cache.stats()
+
+
+# === Bir nechta qismni yuborish ===
+async def send_episodes(bot, chat_id: int, channel, base_id: int, first: int, last: int) -> int:
+    """`first`..`last` qismlarni copyMessages orqali 100 tadan bo‘lib yuboradi; yuborilganlar sonini qaytaradi.
+    aiogram 2 da bu metod yo‘q, shuning uchun to‘g‘ridan-to‘g‘ri `bot.request` ishlatiladi (limiter orqali o‘tadi)."""
+    message_ids = list(range(base_id + first - 1, base_id + last))
+    sent = 0
+    for i in range(0, len(message_ids), COPY_MESSAGES_LIMIT):
+        result = await bot.request("copyMessages", {
+            "chat_id": chat_id,
+            "from_chat_id": channel,
+            "message_ids": json.dumps(message_ids[i:i + COPY_MESSAGES_LIMIT]),
+        })
+        sent += len(result or [])
+    return sent
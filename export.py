@@ -0,0 +1,67 @@
+import io
+import os
+import csv
+import tempfile
+
+from aiogram import types
+
+from database import on_invalidate
+
+EXPORT_SPOOL_SIZE = int(os.getenv("EXPORT_SPOOL_SIZE", str(8 * 1024 * 1024)))  # shundan katta fayl diskka o‘tadi
+
+# kalit ("users", "catalog", "konkurs:5") -> (versiya, file_id, caption)
+_file_ids = {}
+
+# Katalog o‘zgarganda (istalgan instansiyada) versiya oshadi
+_catalog_version = 0
+
+
+def _bump_catalog(code):
+    global _catalog_version
+    _catalog_version += 1
+
+
+on_invalidate("kino", _bump_catalog)
+
+
+def catalog_version() -> int:
+    return _catalog_version
+
+
+# === CSV yaratish ===
+async def build_csv(header, rows):
+    """`rows` (async iterable) ni xotirada (katta bo‘lsa vaqtinchalik faylda) CSV ga yozadi"""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE, mode="w+b")
+    text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")  # BOM - Excel o‘zbekcha harflarni to‘g‘ri ochadi
+    writer = csv.writer(text)
+    writer.writerow(header)
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    spool.seek(0)
+    return spool, count
+
+
+# === Yuborish (file_id versiya bo‘yicha keshlanadi) ===
+async def send_export(bot, chat_id: int, key: str, version, filename: str, header, rows_factory, caption: str = None):
+    """Ma'lumot o‘zgarmagan bo‘lsa oldingi file_id qayta yuboriladi, aks holda fayl qaytadan yaratiladi.
+    `rows_factory()` har chaqirilganda yangi async iterator qaytarishi kerak."""
+    cached = _file_ids.get(key)
+    if cached and cached[0] == version:
+        try:
+            return await bot.send_document(chat_id, cached[1], caption=cached[2])
+        except Exception as e:
+            print(f"[export] {key}: keshlangan file_id ishlamadi -> {e}")
+            _file_ids.pop(key, None)
+
+    spool, count = await build_csv(header, rows_factory())
+    try:
+        caption = f"{caption}\n📦 {count} ta yozuv" if caption else f"📦 {count} ta yozuv"
+        message = await bot.send_document(chat_id, types.InputFile(spool, filename=filename), caption=caption)
+    finally:
+        spool.close()
+    _file_ids[key] = (version, message.document.file_id, caption)
+    return message
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import asyncio
+import typing
+from collections import OrderedDict
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.storage import BaseStorage
+
+import database
+
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 3600)))   # tashlab ketilgan holatlar (sekund)
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_FLUSH_DELAY = float(os.getenv("FSM_FLUSH_DELAY", "1"))          # middleware'siz yozuvlar uchun zaxira
+
+
+# === PostgreSQL FSM storage ===
+class PgStorage(BaseStorage):
+    """aiogram FSM holatlarini `fsm_states` jadvalida saqlaydi.
+    O‘qish lokal keshdan, yozuvlar esa bitta handler ichida yig‘ilib bitta upsert bilan yoziladi."""
+
+    def __init__(self, ttl: float = FSM_STATE_TTL):
+        self.ttl = ttl
+        self._cache = OrderedDict()    # (chat, user) -> {"state", "data", "bucket", "seen"}; LRU tartibida
+        self._dirty = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_handle = None
+
+    # --- Ichki yordamchilar ---
+    async def _load(self, chat, user) -> dict:
+        key = (chat, user)
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            async with database.db_pool.acquire() as conn:
+                row = await conn.fetchrow("""
+                    SELECT state, data, bucket FROM fsm_states
+                    WHERE chat_id = $1 AND user_id = $2
+                      AND updated_at > CURRENT_TIMESTAMP - make_interval(secs => $3)
+                """, chat, user, self.ttl)
+            record = {
+                "state": row["state"] if row else None,
+                "data": json.loads(row["data"]) if row else {},
+                "bucket": json.loads(row["bucket"]) if row else {},
+                "seen": time.monotonic(),
+            }
+            self._cache[key] = record
+            self._evict()
+        record["seen"] = time.monotonic()
+        return record
+
+    def _evict(self):
+        """Eng eski yozuvlar o‘chiriladi; yozilmagan (dirty) yozuvlar o‘z joyida qoldiriladi"""
+        kept = []
+        while self._cache and len(self._cache) + len(kept) > FSM_CACHE_SIZE:
+            key, record = self._cache.popitem(last=False)
+            if key in self._dirty:
+                kept.append((key, record))
+        for key, record in reversed(kept):
+            self._cache[key] = record
+            self._cache.move_to_end(key, last=False)
+
+    def _mark_dirty(self, chat, user):
+        self._dirty.add((chat, user))
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(FSM_FLUSH_DELAY, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        """Yig‘ilgan barcha o‘zgarishlarni bitta so‘rov bilan yozadi"""
+        async with self._flush_lock:
+            if self._flush_handle:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for chat, user in dirty:
+                record = self._cache.get((chat, user))
+                if record is None:
+                    continue
+                if record["state"] is None and not record["data"] and not record["bucket"]:
+                    deletes.append((chat, user))
+                else:
+                    upserts.append((chat, user, record["state"],
+                                    json.dumps(record["data"], ensure_ascii=False),
+                                    json.dumps(record["bucket"], ensure_ascii=False)))
+            try:
+                async with database.db_pool.acquire() as conn:
+                    if upserts:
+                        await conn.executemany("""
+                            INSERT INTO fsm_states (chat_id, user_id, state, data, bucket, updated_at)
+                            VALUES ($1, $2, $3, $4::jsonb, $5::jsonb, CURRENT_TIMESTAMP)
+                            ON CONFLICT (chat_id, user_id) DO UPDATE SET
+                                state = EXCLUDED.state,
+                                data = EXCLUDED.data,
+                                bucket = EXCLUDED.bucket,
+                                updated_at = EXCLUDED.updated_at
+                        """, upserts)
+                    if deletes:
+                        await conn.executemany('DELETE FROM fsm_states WHERE chat_id = $1 AND user_id = $2', deletes)
+            except Exception as e:
+                print(f"[fsm flush] {e}")
+                self._dirty |= dirty
+
+    async def cleanup(self):
+        """TTL'dan o‘tgan (tashlab ketilgan) holatlarni o‘chiradi"""
+        async with database.db_pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM fsm_states WHERE updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)", self.ttl
+            )
+        cutoff = time.monotonic() - self.ttl
+        for key in [k for k, r in self._cache.items() if r["seen"] < cutoff and k not in self._dirty]:
+            del self._cache[key]
+
+    # --- BaseStorage interfeysi ---
+    async def close(self):
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        return record["state"] if record["state"] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        return dict(record["data"]) if record["data"] else dict(default or {})
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        record["state"] = self.resolve_state(state)
+        self._mark_dirty(chat, user)
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        record["data"] = dict(data or {})
+        self._mark_dirty(chat, user)
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        record["data"] = {**record["data"], **(data or {}), **kwargs}
+        self._mark_dirty(chat, user)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        return dict(record["bucket"]) if record["bucket"] else dict(default or {})
+
+    async def set_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        record["bucket"] = dict(bucket or {})
+        self._mark_dirty(chat, user)
+
+    async def update_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = await self._load(chat, user)
+        record["bucket"] = {**record["bucket"], **(bucket or {}), **kwargs}
+        self._mark_dirty(chat, user)
+
+
+# === Har bir update oxirida yig‘ilgan yozuvlarni bitta upsert bilan saqlash ===
+class FSMFlushMiddleware(BaseMiddleware):
+    def __init__(self, storage: PgStorage):
+        super().__init__()
+        self.storage = storage
+
+    async def on_post_process_update(self, update, result, data: dict):
+        await self.storage.flush()
+
+
+async def fsm_cleanup_loop(storage: PgStorage, interval: float = 3600):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await storage.cleanup()
+        except Exception as e:
+            print(f"[fsm cleanup] {e}")
@@ -1,15 +1,118 @@
-from flask import Flask
-from threading import Thread
+import os
+import asyncio
 
-app = Flask('')
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
 
-@app.route('/')
-def home():
-    return "Bot tirik!"
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "64"))  # bir vaqtda qayta ishlanadigan update'lar
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+# Update ichida foydalanuvchi shu maydonlarning birida bo‘ladi
+_USER_FIELDS = ("message", "edited_message", "callback_query", "chat_member", "my_chat_member",
+                "inline_query", "chosen_inline_result", "pre_checkout_query", "shipping_query",
+                "chat_join_request", "poll_answer")
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+
+def update_user_id(data: dict) -> int:
+    """Xom update'dan foydalanuvchi ID'sini topadi (topilmasa 0)"""
+    for field in _USER_FIELDS:
+        obj = data.get(field)
+        if obj:
+            user = obj.get("from") or obj.get("user") or obj.get("chat") or {}
+            return user.get("id", 0)
+    return 0
+
+
+# === Health endpoint ===
+async def home(request):
+    return web.Response(text="Bot tirik!")
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get("/", home)
+    return app
+
+
+async def start_health_server(host="0.0.0.0", port=8080):
+    """Polling rejimida ham health endpoint shu event loop'da ishlaydi (alohida thread'siz)"""
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# === Update'larni qayta ishlash ===
+class UpdateProcessor:
+    """Update'larni fon vazifalarida qayta ishlaydi: umumiy parallellik `concurrency` bilan
+    cheklangan, bitta foydalanuvchining update'lari esa kelgan tartibida ketma-ket bajariladi"""
+
+    def __init__(self, dp: Dispatcher, concurrency: int = WEBHOOK_CONCURRENCY):
+        self.dp = dp
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._locks = {}  # user_id -> [asyncio.Lock, navbatdagilar soni]
+        self._tasks = set()
+
+    def submit(self, data: dict):
+        task = asyncio.create_task(self._process(update_user_id(data), types.Update(**data)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, user_id: int, update: types.Update):
+        slot = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0], self._semaphore:
+                Bot.set_current(self.dp.bot)
+                Dispatcher.set_current(self.dp)
+                try:
+                    await self.dp.process_update(update)
+                except Exception as e:
+                    print(f"[update] {update.update_id} -> {e}")
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                self._locks.pop(user_id, None)
+
+    async def drain(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# === Webhook ===
+class WebhookHandler:
+    """Update'ni qabul qilib darhol 200 qaytaradi; qayta ishlash `sink` ga topshiriladi"""
+
+    def __init__(self, sink, secret: str = None):
+        self.sink = sink
+        self.secret = secret
+
+    async def __call__(self, request: web.Request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            return web.Response(status=403)
+        self.sink(await request.json())
+        return web.Response()
+
+
+async def close_dispatcher(dp: Dispatcher):
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    session = await dp.bot.get_session()
+    await session.close()
+
+
+def run_webhook(dp: Dispatcher, path: str, on_startup, on_shutdown, host="0.0.0.0", port=8080, secret=None):
+    app = create_app()
+    processor = UpdateProcessor(dp)
+    app.router.add_post(path, WebhookHandler(processor.submit, secret))
+
+    async def _startup(app):
+        await on_startup(dp)
+
+    async def _shutdown(app):
+        await processor.drain()
+        await on_shutdown(dp)
+        await close_dispatcher(dp)
+
+    app.on_startup.append(_startup)
+    app.on_shutdown.append(_shutdown)
+    web.run_app(app, host=host, port=port)
@@ -1,45 +1,58 @@
 import os
 import json
-import random
-from typing import List, Dict, Any
+import asyncio
+from typing import List
 from aiogram import types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
-# ==== ENV ====
-MAIN_CHANNELS = [c.strip() for c in (os.getenv("MAIN_CHANNELS") or "").split(",") if c.strip()]
+from subscription import get_unsubscribed, check_member
+from database import (
+    get_channels, is_admin, create_contest, get_contest, get_current_contest, list_contests, set_contest_active,
+    add_contest_post, join_contest, draw_contest_winner, iter_contest_participants, import_contest,
+    save_participant_verdicts, get_eligibility_counts, iter_contest_participant_rows, VERDICT_TTL
+)
+from export import send_export
+from ratelimit import bulk, send_priority, BULK, TokenBucket
 
-# ==== FAYL YO'LLARI ====
+# ==== SOZLAMALAR ====
+KONKURS_VERIFY_WORKERS = int(os.getenv("KONKURS_VERIFY_WORKERS", "10"))   # parallel tekshiruvchilar
+KONKURS_VERIFY_RATE = float(os.getenv("KONKURS_VERIFY_RATE", "20"))       # get_chat_member/sekund
+KONKURS_VERIFY_BATCH = 500                                               # natijalar shuncha-shuncha yoziladi
+KONKURS_PROGRESS_INTERVAL = 3                                            # sekund
+
+# ==== ESKI FAYLLAR (bir martalik ko‘chirish uchun) ====
 DATA_DIR = "participants"
 PARTICIPANTS_FILE = os.path.join(DATA_DIR, "participants.json")
 CONTEST_FILE = os.path.join(DATA_DIR, "contest.json")
 
-# ==== FS ====
-def ensure_dirs():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(PARTICIPANTS_FILE):
-        with open(PARTICIPANTS_FILE, "w", encoding="utf-8") as f:
-            json.dump({"participants": []}, f, indent=2, ensure_ascii=False)
+def _read_legacy_files():
     if not os.path.exists(CONTEST_FILE):
-        with open(CONTEST_FILE, "w", encoding="utf-8") as f:
-            json.dump({"active": False, "post_ids": [], "winners": []}, f, indent=2, ensure_ascii=False)
-
-def load_participants():
-    with open(PARTICIPANTS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def save_participants(data):
-    with open(PARTICIPANTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def load_contest():
+        return None
     with open(CONTEST_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+        contest = json.load(f)
+    participants = []
+    if os.path.exists(PARTICIPANTS_FILE):
+        with open(PARTICIPANTS_FILE, "r", encoding="utf-8") as f:
+            participants = json.load(f).get("participants", [])
+    return contest, participants
 
-def save_contest(data):
-    with open(CONTEST_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+async def migrate_legacy_files():
+    """participants/*.json dagi konkurs bazada konkurs bo‘lmasa import qilinadi, fayllar esa .migrated bo‘ladi"""
+    if await list_contests(limit=1):
+        return
+    loop = asyncio.get_running_loop()
+    legacy = await loop.run_in_executor(None, _read_legacy_files)
+    if not legacy:
+        return
+    contest, participants = legacy
+    contest_id = await import_contest(contest.get("active", False), contest.get("post_ids", []),
+                                      contest.get("winners", []), participants)
+    for path in (CONTEST_FILE, PARTICIPANTS_FILE):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    print(f"✅ Konkurs #{contest_id} JSON fayllardan ko‘chirildi ({len(participants)} ishtirokchi)")
 
 # ==== HOLATLAR ====
 class KonkursStates(StatesGroup):
@@ -47,44 +60,173 @@ class KonkursStates(StatesGroup):
     waiting_for_caption = State()
 
 # ==== TUGMALAR ====
-def konkurs_menu_kb():
+MEDALS = ["🥇", "🥈", "🥉"]
+MAX_WINNERS = len(MEDALS)
+
+def konkurs_list_kb(contests):
+    kb = InlineKeyboardMarkup(row_width=1)
+    for contest in contests:
+        status = "🟢" if contest["active"] else "🔴"
+        kb.add(InlineKeyboardButton(
+            f"{status} #{contest['id']} — {contest['participant_count']} ishtirokchi",
+            callback_data=f"konkurs:open:{contest['id']}"
+        ))
+    kb.add(InlineKeyboardButton("🚀 Yangi konkurs boshlash", callback_data="konkurs:start"))
+    return kb
+
+def konkurs_menu_kb(contest_id: int):
     kb = InlineKeyboardMarkup(row_width=1)
     kb.add(
-        InlineKeyboardButton("🚀 Konkursni boshlash", callback_data="konkurs:start"),
-        InlineKeyboardButton("🏅 G‘olibni aniqlash", callback_data="konkurs:pick"),
-        InlineKeyboardButton("👥 Ishtirokchilar", callback_data="konkurs:participants"),
-        InlineKeyboardButton("⛔️ Konkursni yakunlash", callback_data="konkurs:finish"),
+        InlineKeyboardButton("🔎 Ishtirokchilarni tekshirish", callback_data=f"konkurs:verify:{contest_id}"),
+        InlineKeyboardButton("🏅 G‘olibni aniqlash", callback_data=f"konkurs:pick:{contest_id}"),
+        InlineKeyboardButton("👥 Ishtirokchilar", callback_data=f"konkurs:participants:{contest_id}"),
+        InlineKeyboardButton("⛔️ Konkursni yakunlash", callback_data=f"konkurs:finish:{contest_id}"),
+        InlineKeyboardButton("🔙 Konkurslar", callback_data="konkurs:list"),
     )
     return kb
 
-def participate_kb(bot_username: str):
+def contest_text(contest: dict) -> str:
+    status = "🟢 Faol" if contest["active"] else "🔴 Faol emas"
+    text = f"🏆 Konkurs #{contest['id']}\nHolat: {status}\nIshtirokchilar: {contest['participant_count']} ta"
+    if contest["winners"]:
+        text += "\nG‘oliblar: " + ", ".join(f"{MEDALS[i]} {uid}" for i, uid in enumerate(contest["winners"][:MAX_WINNERS]))
+    return text
+
+def participate_kb(bot_username: str, contest_id: int):
     kb = InlineKeyboardMarkup()
-    kb.add(InlineKeyboardButton("✅ Ishtirok etish", url=f"https://t.me/{bot_username}?start=konkurs"))
+    kb.add(InlineKeyboardButton("✅ Ishtirok etish", url=f"https://t.me/{bot_username}?start=konkurs_{contest_id}"))
     return kb
 
 # ==== SUBS TEKSHIRUV ====
 async def is_user_subscribed(bot, user_id: int) -> bool:
-    if not MAIN_CHANNELS:
+    main_channels = get_channels("main")
+    if not main_channels:
         return True
-    for ch in MAIN_CHANNELS:
+    return not await get_unsubscribed(bot, main_channels, user_id)
+
+async def check_eligibility(bot, user_id: int, bucket: TokenBucket = None):
+    """Barcha asosiy kanallarga obunami: True/False, tekshirib bo‘lmasa None (natija saqlanmaydi)"""
+    channels = get_channels("main")
+    if not channels:
+        return True
+
+    async def one(channel):
+        if bucket:
+            await bucket.acquire()
+        return await check_member(bot, channel, user_id)
+
+    try:
+        return all(await asyncio.gather(*(one(ch) for ch in channels)))
+    except Exception as e:
+        print(f"[verify] {user_id} -> {e}")
+        return None
+
+# ==== G‘OLIB TANLASHDAN OLDINGI TEKSHIRUV ====
+_verifying = set()  # hozir tekshirilayotgan konkurslar
+
+async def verify_participants(bot, contest_id: int, on_progress=None) -> dict:
+    """Natijasi yo‘q yoki eskirgan ishtirokchilarni parallel (rate limit bilan) qayta tekshiradi.
+    `on_progress(stats)` har KONKURS_PROGRESS_INTERVAL sekundda chaqiriladi."""
+    stats = {"checked": 0, "eligible": 0, "ineligible": 0, "unknown": 0}
+    bucket = TokenBucket(KONKURS_VERIFY_RATE)
+    queue = asyncio.Queue(maxsize=KONKURS_VERIFY_WORKERS * 4)
+    verdicts = []
+
+    async def flush():
+        batch = verdicts[:]
+        del verdicts[:]
         try:
-            member = await bot.get_chat_member(ch, user_id)
-            if getattr(member, "status", None) not in ("member", "administrator", "creator"):
-                return False
-        except:
-            return False
-    return True
+            await save_participant_verdicts(contest_id, batch)
+        except Exception as e:
+            print(f"[verify] konkurs #{contest_id}: {len(batch)} ta natijani saqlab bo‘lmadi -> {e}")
+            verdicts.extend(batch)  # keyingi flush'da qayta urinamiz
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            # Bitta xato worker'ni o‘ldirmasligi kerak - aks holda navbat to‘lib, tekshiruv osilib qoladi
+            try:
+                verdict = await check_eligibility(bot, user_id, bucket)
+                stats["checked"] += 1
+                if verdict is None:
+                    stats["unknown"] += 1
+                    continue
+                stats["eligible" if verdict else "ineligible"] += 1
+                verdicts.append((user_id, verdict))
+                if len(verdicts) >= KONKURS_VERIFY_BATCH:
+                    await flush()
+            except Exception as e:
+                print(f"[verify] {user_id} -> {e}")
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(KONKURS_PROGRESS_INTERVAL)
+            await on_progress(stats)
+
+    workers = [asyncio.create_task(worker()) for _ in range(KONKURS_VERIFY_WORKERS)]
+    progress = asyncio.create_task(reporter()) if on_progress else None
+    try:
+        async for user_id in iter_contest_participants(contest_id, stale_after=VERDICT_TTL):
+            await queue.put(user_id)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        if progress:
+            progress.cancel()
+        await flush()
+    return stats
+
+def verify_text(contest_id: int, stats: dict, counts: dict = None, done: bool = False) -> str:
+    title = "✅ Tekshiruv yakunlandi" if done else "🔎 Tekshirilmoqda..."
+    text = (
+        f"{title} (konkurs #{contest_id})\n\n"
+        f"📦 Tekshirildi: {stats['checked']} ta\n"
+        f"✅ Obuna: {stats['eligible']} ta\n"
+        f"🚫 Obunadan chiqqan: {stats['ineligible']} ta\n"
+        f"❓ Aniqlanmadi: {stats['unknown']} ta"
+    )
+    if counts:
+        text += (
+            f"\n\n📊 Jami: {counts['eligible']} ta yaroqli, {counts['ineligible']} ta yaroqsiz, "
+            f"{counts['unchecked']} ta tekshirilmagan"
+        )
+    return text
+
+async def run_verification(bot, contest_id: int, chat_id: int, message_id: int):
+    if contest_id in _verifying:
+        return
+    _verifying.add(contest_id)
+
+    async def on_progress(stats):
+        try:
+            await bot.edit_message_text(verify_text(contest_id, stats), chat_id, message_id)
+        except Exception as e:
+            print(f"[verify progress] {e}")
+
+    try:
+        stats = await verify_participants(bot, contest_id, on_progress)
+        counts = await get_eligibility_counts(contest_id)
+        await bot.edit_message_text(verify_text(contest_id, stats, counts, done=True), chat_id, message_id)
+    except Exception as e:
+        print(f"[verify] konkurs #{contest_id} -> {e}")
+    finally:
+        _verifying.discard(contest_id)
 
 # ==== E'LON & DM ====
+@bulk
 async def announce_winners_to_channels(bot, winners: List[int]):
     if not winners:
         return 0, 0
     text = "🏆 <b>Konkurs yakunlandi!</b>\n\nG‘oliblar:\n"
-    medals = ["🥇", "🥈", "🥉"]
-    for i, uid in enumerate(winners[:3]):
-        text += f"{medals[i]} <a href='tg://user?id={uid}'>{uid}</a>\n"
+    for i, uid in enumerate(winners[:MAX_WINNERS]):
+        text += f"{MEDALS[i]} <a href='tg://user?id={uid}'>{uid}</a>\n"
     ok = fail = 0
-    for ch in MAIN_CHANNELS:
+    for ch in get_channels("main"):
         try:
             await bot.send_message(ch, text, parse_mode="HTML", disable_web_page_preview=True)
             ok += 1
@@ -93,117 +235,135 @@ async def announce_winners_to_channels(bot, winners: List[int]):
             fail += 1
     return ok, fail
 
+@bulk
 async def dm_winners(bot, winners: List[int]):
-    medals = ["🥇", "🥈", "🥉"]
-    for i, uid in enumerate(winners[:3]):
+    for i, uid in enumerate(winners[:MAX_WINNERS]):
         try:
             await bot.send_message(
                 uid,
-                f"{medals[i]} Tabriklaymiz! Siz g‘olib bo‘ldingiz. 🎉\nAdmin tez orada bog‘lanadi.",
+                f"{MEDALS[i]} Tabriklaymiz! Siz g‘olib bo‘ldingiz. 🎉\nAdmin tez orada bog‘lanadi.",
                 parse_mode="HTML"
             )
         except Exception as e:
             print(f"[dm_winner] {uid} -> {e}")
 
-# ==== HANDLERLAR ====
-def register_konkurs_handlers(dp, bot, ADMINS: set):
+# ==== ISHTIROK ====
+async def join_konkurs(message: types.Message, args: str = "konkurs"):
+    """`/start konkurs_<id>` (eski postlarda `/start konkurs`) - main.py dagi start handleridan chaqiriladi"""
+    _, _, contest_id = args.partition("_")
+    if contest_id.isdigit():
+        contest = await get_contest(int(contest_id))
+    else:
+        contest = await get_current_contest()
+    if not contest or not contest["active"]:
+        await message.answer("ℹ️ Bu konkurs faol emas.")
+        return
+    subscribed = await is_user_subscribed(message.bot, message.from_user.id)
+    if not subscribed:
+        await message.answer("❗️ Avval kanallarga obuna bo‘ling, so‘ngra qayta urinib ko‘ring.")
+        return
+    if await join_contest(contest["id"], message.from_user.id):
+        await message.answer("✅ Ishtirok uchun rahmat! Siz ro‘yxatga qo‘shildingiz.")
+    else:
+        await message.answer("ℹ️ Siz allaqachon ro‘yxatdasiz.")
 
-    ensure_dirs()
+async def finish_contest(bot, contest: dict):
+    await set_contest_active(contest["id"], False)
+    if not contest["winners"]:
+        return None
+    ok, fail = await announce_winners_to_channels(bot, contest["winners"])
+    await dm_winners(bot, contest["winners"])
+    return ok, fail
 
-    @dp.message_handler(commands=["start"])
-    async def cmd_start(message: types.Message):
-        args = message.get_args().strip() if hasattr(message, "get_args") else ""
-        if args == "konkurs":
-            subscribed = await is_user_subscribed(message.bot, message.from_user.id)
-            if not subscribed:
-                await message.answer("❗️ Avval kanallarga obuna bo‘ling, so‘ngra qayta urinib ko‘ring.")
-                return
-            pdata = load_participants()
-            arr = pdata.get("participants", [])
-            if message.from_user.id not in arr:
-                arr.append(message.from_user.id)
-                pdata["participants"] = arr
-                save_participants(pdata)
-            await message.answer("✅ Ishtirok uchun rahmat! Siz ro‘yxatga qo‘shildingiz.")
-            return
-        await message.answer("Salom! Bu bot konkurslar o‘tkazadi.")
+# ==== HANDLERLAR ====
+def register_konkurs_handlers(dp, bot, router):
 
-    @dp.message_handler(lambda m: m.text == "🏆 Konkurs")
+    @router.text("🏆 Konkurs")
     async def open_konkurs_menu(message: types.Message):
-        if message.from_user.id not in ADMINS:
+        if not is_admin(message.from_user.id):
             return
-        st = load_contest()
-        status = "🟢 Faol" if st.get("active") else "🔴 Faol emas"
-        winners = st.get("winners", [])
-        win_line = f"\nG‘oliblar soni: {len(winners)}" if winners else ""
-        await message.answer(f"🏆 Konkurs bo‘limi\nHolat: {status}{win_line}", reply_markup=konkurs_menu_kb())
+        await message.answer("🏆 Konkurs bo‘limi", reply_markup=konkurs_list_kb(await list_contests()))
 
-    @dp.callback_query_handler(lambda c: c.data.startswith("konkurs:"))
+    @router.callback("konkurs:")
     async def konkurs_menu_cb(callback: CallbackQuery, state: FSMContext):
-        if callback.from_user.id not in ADMINS:
+        if not is_admin(callback.from_user.id):
             await callback.answer()
             return
-        _, action = callback.data.split(":", 1)
+        _, action, *rest = callback.data.split(":")
         if action == "start":
             await KonkursStates.waiting_for_image.set()
             await callback.message.answer("🖼 Konkurs post uchun rasm yuboring.")
+            await callback.answer()
+            return
+        if action == "list":
+            await callback.message.edit_text("🏆 Konkurs bo‘limi", reply_markup=konkurs_list_kb(await list_contests()))
+            await callback.answer()
+            return
+
+        contest = await get_contest(int(rest[0])) if rest and rest[0].isdigit() else None
+        if not contest:
+            await callback.answer("ℹ️ Konkurs topilmadi.", show_alert=True)
+            return
+        await callback.answer()
+
+        if action == "open":
+            await callback.message.edit_text(contest_text(contest), reply_markup=konkurs_menu_kb(contest["id"]))
         elif action == "participants":
-            data = load_participants()
-            ids = data.get("participants", [])
-            if not ids:
+            if not contest["participant_count"]:
                 await callback.message.answer("ℹ️ Ishtirokchilar yo‘q.")
             else:
-                chunk = "👥 Ishtirokchilar:\n\n"
-                for i, uid in enumerate(ids, 1):
-                    line = f"{i}. <code>{uid}</code>\n"
-                    if len(chunk) + len(line) > 3800:
-                        await callback.message.answer(chunk, parse_mode="HTML")
-                        chunk = ""
-                    chunk += line
-                if chunk:
-                    await callback.message.answer(chunk, parse_mode="HTML")
+                # Ro‘yxat bitta CSV fayl; ishtirokchilar soni o‘zgarmaguncha file_id qayta ishlatiladi
+                await send_export(
+                    bot, callback.message.chat.id, f"konkurs:{contest['id']}", contest["participant_count"],
+                    f"konkurs_{contest['id']}_ishtirokchilar.csv", ("seq", "user_id", "joined_at"),
+                    lambda: iter_contest_participant_rows(contest["id"]),
+                    caption=f"👥 Konkurs #{contest['id']} ishtirokchilari"
+                )
+        elif action == "verify":
+            if contest["id"] in _verifying:
+                await callback.message.answer("⏳ Bu konkurs allaqachon tekshirilmoqda.")
+                return
+            status = await callback.message.answer(f"🔎 Konkurs #{contest['id']} ishtirokchilari tekshirilmoqda...")
+            # Uzoq jarayon - handler (va foydalanuvchi navbati) band qilinmaydi
+            asyncio.create_task(run_verification(callback.message.bot, contest["id"], status.chat.id, status.message_id))
         elif action == "finish":
-            st = load_contest()
-            st["active"] = False
-            save_contest(st)
-            winners = st.get("winners", [])
-            if winners:
-                ok, fail = await announce_winners_to_channels(callback.message.bot, winners)
-                await dm_winners(callback.message.bot, winners)
-                await callback.message.answer(f"✅ Konkurs yakunlandi. E’lon: {ok} ta, xato: {fail} ta.")
+            result = await finish_contest(callback.message.bot, contest)
+            if result:
+                await callback.message.answer(f"✅ Konkurs #{contest['id']} yakunlandi. E’lon: {result[0]} ta, xato: {result[1]} ta.")
             else:
-                await callback.message.answer("✅ Konkurs yakunlandi (g‘oliblar yo‘q).")
+                await callback.message.answer(f"✅ Konkurs #{contest['id']} yakunlandi (g‘oliblar yo‘q).")
         elif action == "pick":
-            st = load_contest()
-            if not st.get("active"):
+            if not contest["active"]:
                 await callback.message.answer("ℹ️ Konkurs faol emas.")
                 return
-            pdata = load_participants()
-            participants = pdata.get("participants", [])
-            winners = st.get("winners", [])
-            if len(winners) >= 3:
-                await callback.message.answer("✅ 3 ta g‘olib tanlangan.")
+            if len(contest["winners"]) >= MAX_WINNERS:
+                await callback.message.answer(f"✅ {MAX_WINNERS} ta g‘olib tanlangan.")
                 return
-            candidates = [uid for uid in participants if uid not in winners]
-            if not candidates:
-                await callback.message.answer("❌ Nomzod qolmadi.")
+            # Tekshiruvdan o‘tmaganlar rad etiladi, natijasi eskirgan nomzod esa shu yerda qayta tekshiriladi
+            draw = await draw_contest_winner(contest["id"], verify=lambda user_id: check_eligibility(bot, user_id),
+                                             max_winners=MAX_WINNERS)
+            if not draw:
+                # Parallel tanlash oxirgi o‘rinni egallagan bo‘lishi mumkin
+                contest = await get_contest(contest["id"])
+                if contest and len(contest["winners"]) >= MAX_WINNERS:
+                    await callback.message.answer(f"✅ {MAX_WINNERS} ta g‘olib tanlangan.")
+                else:
+                    await callback.message.answer("❌ Nomzod qolmadi.")
                 return
-            winner = random.choice(candidates)
-            winners.append(winner)
-            st["winners"] = winners
-            save_contest(st)
-            medals = ["🥇", "🥈", "🥉"]
-            await callback.message.answer(f"{medals[len(winners)-1]} G‘olib: <a href='tg://user?id={winner}'>{winner}</a>", parse_mode="HTML")
-            if len(winners) == 3:
-                st["active"] = False
-                save_contest(st)
-                ok, fail = await announce_winners_to_channels(callback.message.bot, winners)
-                await dm_winners(callback.message.bot, winners)
-                await callback.message.answer(f"🏁 Konkurs yakunlandi.\n📣 E’lon: {ok} ta, xato: {fail} ta.")
+            winner = draw["user_id"]
+            await callback.message.answer(
+                f"{MEDALS[draw['place'] - 1]} G‘olib: <a href='tg://user?id={winner}'>{winner}</a>\n"
+                f"🎲 Seed: <code>{draw['seed']}</code>",
+                parse_mode="HTML"
+            )
+            if draw["place"] == MAX_WINNERS:
+                contest = await get_contest(contest["id"])
+                ok, fail = await finish_contest(callback.message.bot, contest)
+                await callback.message.answer(f"🏁 Konkurs #{contest['id']} yakunlandi.\n📣 E’lon: {ok} ta, xato: {fail} ta.")
 
     @dp.message_handler(content_types=types.ContentType.PHOTO, state=KonkursStates.waiting_for_image)
     async def konkurs_get_image(message: types.Message, state: FSMContext):
-        if message.from_user.id not in ADMINS:
+        if not is_admin(message.from_user.id):
             return
         await state.update_data(photo=message.photo[-1].file_id)
         await KonkursStates.waiting_for_caption.set()
@@ -211,34 +371,28 @@ def register_konkurs_handlers(dp, bot, ADMINS: set):
 
     @dp.message_handler(state=KonkursStates.waiting_for_caption)
     async def konkurs_get_caption_and_post(message: types.Message, state: FSMContext):
-        if message.from_user.id not in ADMINS:
+        if not is_admin(message.from_user.id):
             return
         data = await state.get_data()
         photo_id = data.get("photo")
         caption = (message.text or "").strip()
-        if not MAIN_CHANNELS:
-            await message.answer("❌ MAIN_CHANNELS topilmadi.")
+        main_channels = get_channels("main")
+        if not main_channels:
+            await message.answer("❌ Asosiy kanallar topilmadi.")
             await state.finish()
             return
-        st = load_contest()
-        st["active"] = True
-        st["post_ids"] = []
-        st["winners"] = []
-        save_contest(st)
+        contest_id = await create_contest()
         me = await message.bot.get_me()
-        kb = participate_kb(me.username)
+        kb = participate_kb(me.username, contest_id)
         ok = fail = 0
-        for ch in MAIN_CHANNELS:
-            try:
-                sent = await message.bot.send_photo(ch, photo=photo_id, caption=caption, reply_markup=kb)
-                st = load_contest()
-                post_ids = st.get("post_ids", [])
-                post_ids.append({"chat": ch, "message_id": sent.message_id})
-                st["post_ids"] = post_ids
-                save_contest(st)
-                ok += 1
-            except Exception as e:
-                print(f"[POST] {ch} -> {e}")
-                fail += 1
-        await message.answer(f"✅ Yuborildi: {ok} ta\n❌ Xato: {fail} ta\n🟢 Konkurs FAOL")
+        with send_priority(BULK):
+            for ch in main_channels:
+                try:
+                    sent = await message.bot.send_photo(ch, photo=photo_id, caption=caption, reply_markup=kb)
+                    await add_contest_post(contest_id, ch, sent.message_id)
+                    ok += 1
+                except Exception as e:
+                    print(f"[POST] {ch} -> {e}")
+                    fail += 1
+        await message.answer(f"✅ Yuborildi: {ok} ta\n❌ Xato: {fail} ta\n🟢 Konkurs #{contest_id} FAOL")
         await state.finish()
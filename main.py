@@ -8,34 +8,74 @@ from datetime import datetime, date
 from dotenv import load_dotenv
 
 # === 🤖 Aiogram kutubxonalari ===
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.utils import executor
-from aiogram.utils.exceptions import RetryAfter, BotBlocked, ChatNotFound
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import MessageNotModified
 from aiogram.utils.markdown import escape_md
 
 # === 📂 Loyihaga tegishli modullar ===
-from konkurs import register_konkurs_handlers
-from keep_alive import keep_alive
-from database import init_db, add_user, get_user_count, add_kino_code, get_kino_by_code, get_all_codes, delete_kino_code, get_code_stat, increment_stat, get_all_user_ids, update_anime_code, get_today_users
+from konkurs import register_konkurs_handlers, join_konkurs, migrate_legacy_files
+from routing import Router, AdminFilter
+from ratelimit import RateLimitedBot, PriorityMiddleware
+from episodes import episode_keyboard, send_episodes
+from export import send_export, catalog_version
+from catalog import catalog_page
+from fsm_storage import PgStorage, FSMFlushMiddleware, fsm_cleanup_loop
+from broadcast import BroadcastStats, job_markup, run_broadcast_job, stop_broadcast_job, resume_broadcast_jobs
+from subscription import get_unsubscribed, forget_channel, apply_chat_member_update, membership_stats, get_channel_links, warm_channel_meta, channel_meta_refresher
+from keep_alive import start_health_server, run_webhook, WEBHOOK_CONCURRENCY
+from workers import run_workers, is_primary_worker, BOT_WORKERS
+from database import init_db, migrate_db, close_db, add_user, get_user_count, get_active_user_count, get_users_version, iter_user_rows, iter_catalog, add_kino_code, get_kino_by_code, get_kino_count, delete_kino_code, get_code_stat, increment_stat, update_anime_code, get_today_users, get_channels, add_channel, remove_channel, on_invalidate, is_admin, get_admins, add_admin, remove_admin, kino_cache_stats, clear_kino_cache, touch_user, create_broadcast_job, set_broadcast_status_message, set_broadcast_status
 
 
 load_dotenv()
-keep_alive()
 
 API_TOKEN = os.getenv("API_TOKEN")
-CHANNELS = ["@anilordtv"]
-MAIN_CHANNELS = ["@anilordtv"]
 BOT_USERNAME = os.getenv("BOT_USERNAME")
 
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+# === Ishga tushirish rejimi: WEBHOOK_HOST berilsa webhook, aks holda polling ===
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST")              # masalan: https://mybot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+PORT = int(os.getenv("PORT", "8080"))
+
+# Barcha chiquvchi xabarlar global/chat/guruh limitlari orqali o‘tadi (ratelimit.py)
+bot = RateLimitedBot(token=API_TOKEN)
+# FSM holatlari PostgreSQL'da (restart va ko‘p jarayonli rejimda saqlanadi)
+storage = PgStorage()
 dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(FSMFlushMiddleware(storage))
+# Interaktiv javoblar broadcast/konkurs e'lonlaridan oldin yuboriladi
+dp.middleware.setup(PriorityMiddleware(is_admin))
+
+
+# Faqat /start emas, har qanday xabar/tugma foydalanuvchini faol deb belgilaydi (buferlangan, throttling bilan)
+class ActivityMiddleware(BaseMiddleware):
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if message.from_user and message.chat.type == "private":
+            touch_user(message.from_user.id)
+
+    async def on_pre_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        touch_user(callback.from_user.id)
+
 
-ADMINS = {7483732504}
+dp.middleware.setup(ActivityMiddleware())
+# Adminlar `admins` jadvalidan yuklanadi; handlerlarda `is_admin=True` filtri ishlatiladi
+dp.filters_factory.bind(AdminFilter)
+
+# Matnli tugmalar va callback'lar uchun marshrutlash jadvali (routing.py)
+router = Router(is_admin=is_admin)
+router.setup(dp)
+
+# chat_member update'lari faqat aniq so‘ralganda keladi (obuna keshi uchun kerak)
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member"]
+
+# Boshqa instansiyada kanal o‘chirilsa/qo‘shilsa uning obuna keshi ham tashlanadi
+on_invalidate("channels", lambda channel: forget_channel(channel) if channel else None)
 
 class AdminStates(StatesGroup):
     waiting_for_kino_data = State()
@@ -104,6 +144,12 @@ async def start_handler(message: types.Message):
         await add_user(user_id)
     except Exception as e:
         print(f"[add_user] {user_id} -> {e}")
+
+    # Konkurs posti tugmasi: /start konkurs_<id> (asosiy kanallarga obuna konkurs.py da tekshiriladi)
+    if args == "konkurs" or args.startswith("konkurs_"):
+        await join_konkurs(message, args)
+        return
+
     try:
         unsubscribed = await get_unsubscribed_channels(user_id) if 'get_unsubscribed_channels' in globals() else []
     except Exception as e:
@@ -112,7 +158,7 @@ async def start_handler(message: types.Message):
 
     if unsubscribed:
         # faqat obuna bo‘lmaganlarni chiqaramiz
-        markup = await make_unsubscribed_markup(user_id, args)
+        markup = await make_unsubscribed_markup(user_id, args, unsubscribed)
         await message.answer(
             "❗ Botdan foydalanish uchun quyidagi kanal(lar)ga obuna bo‘ling:",
             reply_markup=markup
@@ -133,7 +179,7 @@ async def start_handler(message: types.Message):
         return
         
     try:
-        if user_id in ADMINS:
+        if is_admin(user_id):
             await message.answer(f"👮‍♂️ Admin panel:\n🆔 Sizning ID: <code>{user_id}</code>", reply_markup=admin_keyboard(), parse_mode="HTML")
         else:
             kb = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -150,72 +196,43 @@ async def start_handler(message: types.Message):
         print(f"[menu] {user_id} -> {e}")
 
 # === Obuna tekshirish uchun yordamchi funksiyalar (agar mavjud bo'lsa) ===
-async def make_subscribe_markup(code):
+async def make_subscribe_markup(code, channels=None):
     keyboard = InlineKeyboardMarkup(row_width=1)
-    for channel in CHANNELS:
-        try:
-            invite_link = await bot.create_chat_invite_link(channel.strip())
-            keyboard.add(InlineKeyboardButton("📢 Obuna bo‘lish", url=invite_link.invite_link))
-        except Exception as e:
-            print(f"❌ Link yaratishda xatolik: {channel} -> {e}")
-    keyboard.add(InlineKeyboardButton("✅ Tekshirish", callback_data=f"check_sub:{code}"))
+    for _, _, invite_link in await get_channel_links(bot, get_channels("sub") if channels is None else channels):
+        keyboard.add(InlineKeyboardButton("📢 Obuna bo‘lish", url=invite_link))
+    keyboard.add(InlineKeyboardButton("✅ Tekshirish", callback_data=f"checksub:{code}"))
     return keyboard
 
 async def get_unsubscribed_channels(user_id):
-    unsubscribed = []
-    for channel in CHANNELS:
-        try:
-            member = await bot.get_chat_member(channel.strip(), user_id)
-            if member.status not in ["member", "administrator", "creator"]:
-                unsubscribed.append(channel)
-        except Exception as e:
-            print(f"❗ Obuna tekshirishda xatolik: {channel} -> {e}")
-            unsubscribed.append(channel)
-    return unsubscribed
+    return await get_unsubscribed(bot, get_channels("sub"), user_id)
 
 async def is_user_subscribed(user_id):
-    for channel in CHANNELS:
-        try:
-            member = await bot.get_chat_member(channel.strip(), user_id)
-            if member.status not in ["member", "administrator", "creator"]:
-                return False
-        except Exception as e:
-            print(f"❗ Obuna holatini aniqlab bo‘lmadi: {channel} -> {e}")
-            return False
-    return True
+    return not await get_unsubscribed_channels(user_id)
+
+# === Kanal a'zoligi o‘zgarganda obuna keshini yangilash ===
+@dp.chat_member_handler()
+async def on_chat_member_update(update: types.ChatMemberUpdated):
+    apply_chat_member_update(update)
     
-async def make_unsubscribed_markup(user_id: int, code: str):
+async def make_unsubscribed_markup(user_id: int, code: str, unsubscribed=None, check_text="✅ Tekshirish"):
     markup = InlineKeyboardMarkup(row_width=1)
-    unsubscribed = await get_unsubscribed_channels(user_id)
+    if unsubscribed is None:
+        unsubscribed = await get_unsubscribed_channels(user_id)
 
-    for ch in unsubscribed:
-        try:
-            chat = await bot.get_chat(ch.strip())
-            invite_link = chat.invite_link or await bot.export_chat_invite_link(chat.id)
-            title = chat.title or ch
-            markup.add(InlineKeyboardButton(f"➕ {title}", url=invite_link))
-        except Exception as e:
-            print(f"❗ Kanal linkini olishda xatolik: {ch} -> {e}")
+    for _, title, invite_link in await get_channel_links(bot, unsubscribed):
+        markup.add(InlineKeyboardButton(f"➕ {title}", url=invite_link))
 
-    markup.add(InlineKeyboardButton("✅ Tekshirish", callback_data=f"checksub:{code}"))
+    markup.add(InlineKeyboardButton(check_text, callback_data=f"checksub:{code}"))
     return markup
 
 # === Obuna tekshirish callback ===
-@dp.callback_query_handler(lambda c: c.data.startswith("checksub:"))
+@router.callback("checksub:")
 async def check_subscription_callback(call: CallbackQuery):
     code = call.data.split(":")[1]
     unsubscribed = await get_unsubscribed_channels(call.from_user.id)
 
     if unsubscribed:
-        markup = InlineKeyboardMarkup(row_width=1)
-        for ch in unsubscribed:
-            try:
-                channel = await bot.get_chat(ch.strip())
-                invite_link = channel.invite_link or (await bot.export_chat_invite_link(channel.id))
-                markup.add(InlineKeyboardButton(f"➕ {channel.title}", url=invite_link))
-            except Exception as e:
-                print(f"❗ Kanalni olishda xatolik: {ch} -> {e}")
-        markup.add(InlineKeyboardButton("✅ Yana tekshirish", callback_data=f"checksub:{code}"))
+        markup = await make_unsubscribed_markup(call.from_user.id, code, unsubscribed, "✅ Yana tekshirish")
         await call.message.edit_text("❗ Obuna bo‘lmagan kanal(lar):", reply_markup=markup)
     else:
         await call.message.delete()
@@ -223,7 +240,7 @@ async def check_subscription_callback(call: CallbackQuery):
         await increment_stat(code, "searched")
 
 # === 📡 KANAL BOSHQARUVI ===
-@dp.message_handler(lambda m: m.text == "📡 Kanal boshqaruvi", user_id=ADMINS)
+@router.text("📡 Kanal boshqaruvi", admin_only=True)
 async def kanal_boshqaruvi(message: types.Message):
     kb = InlineKeyboardMarkup()
     kb.add(
@@ -234,7 +251,7 @@ async def kanal_boshqaruvi(message: types.Message):
 
 
 # === TUR TANLASH ===
-@dp.callback_query_handler(lambda c: c.data.startswith("channel_type:"), user_id=ADMINS)
+@router.callback("channel_type:", admin_only=True)
 async def select_channel_type(callback: types.CallbackQuery, state: FSMContext):
     ctype = callback.data.split(":")[1]
 
@@ -260,7 +277,7 @@ async def select_channel_type(callback: types.CallbackQuery, state: FSMContext):
 
 
 # === ACTION TANLASH ===
-@dp.callback_query_handler(lambda c: c.data.startswith("action:"), user_id=ADMINS)
+@router.callback("action:", admin_only=True)
 async def channel_actions(callback: types.CallbackQuery, state: FSMContext):
     action = callback.data.split(":")[1]
     data = await state.get_data()
@@ -276,35 +293,35 @@ async def channel_actions(callback: types.CallbackQuery, state: FSMContext):
 
     elif action == "list":
         if ctype == "sub":
-            if not CHANNELS:
+            if not get_channels("sub"):
                 await callback.message.answer("📭 Majburiy obuna kanali yo‘q.")
             else:
                 text = "📋 Majburiy obuna kanallari:\n\n"
-                for i, ch in enumerate(CHANNELS, 1):
+                for i, ch in enumerate(get_channels("sub"), 1):
                     text += f"{i}. {ch}\n"
                 await callback.message.answer(text)
         else:
-            if not MAIN_CHANNELS:
+            if not get_channels("main"):
                 await callback.message.answer("📭 Asosiy kanal yo‘q.")
             else:
                 text = "📌 Asosiy kanallar:\n\n"
-                for i, ch in enumerate(MAIN_CHANNELS, 1):
+                for i, ch in enumerate(get_channels("main"), 1):
                     text += f"{i}. {ch}\n"
                 await callback.message.answer(text)
 
     elif action == "delete":
         kb = InlineKeyboardMarkup()
         if ctype == "sub":
-            if not CHANNELS:
+            if not get_channels("sub"):
                 await callback.message.answer("📭 Majburiy obuna kanali yo‘q.")
                 return
-            for ch in CHANNELS:
+            for ch in get_channels("sub"):
                 kb.add(InlineKeyboardButton(f"O‘chirish: {ch}", callback_data=f"delch:{ch}"))
         else:
-            if not MAIN_CHANNELS:
+            if not get_channels("main"):
                 await callback.message.answer("📭 Asosiy kanal yo‘q.")
                 return
-            for ch in MAIN_CHANNELS:
+            for ch in get_channels("main"):
                 kb.add(InlineKeyboardButton(f"O‘chirish: {ch}", callback_data=f"delmain:{ch}"))
 
         await callback.message.answer("❌ Qaysi kanalni o‘chirmoqchisiz?", reply_markup=kb)
@@ -321,7 +338,7 @@ async def channel_actions(callback: types.CallbackQuery, state: FSMContext):
 
 
 # === ➕ KANAL QO‘SHISH (STATE) ===
-@dp.message_handler(state=KanalStates.waiting_for_channel, user_id=ADMINS)
+@dp.message_handler(state=KanalStates.waiting_for_channel, is_admin=True)
 async def add_channel_finish(message: types.Message, state: FSMContext):
     data = await state.get_data()
     ctype = data.get("channel_type")
@@ -332,38 +349,37 @@ async def add_channel_finish(message: types.Message, state: FSMContext):
         return
 
     if ctype == "sub":
-        if channel in CHANNELS:
+        if not await add_channel("sub", channel):
             await message.answer("ℹ️ Bu kanal allaqachon ro‘yxatda bor.")
         else:
-            CHANNELS.append(channel)
+            await warm_channel_meta(bot, [channel])
             await message.answer(f"✅ {channel} qo‘shildi (majburiy obuna).")
     else:
-        if channel in MAIN_CHANNELS:
+        if not await add_channel("main", channel):
             await message.answer("ℹ️ Bu kanal allaqachon ro‘yxatda bor.")
         else:
-            MAIN_CHANNELS.append(channel)
             await message.answer(f"✅ {channel} qo‘shildi (asosiy kanal).")
 
     await state.finish()
 
 
 # === ❌ O‘CHIRISH HANDLERLARI ===
-@dp.callback_query_handler(lambda c: c.data.startswith("delch:"), user_id=ADMINS)
+@router.callback("delch:", admin_only=True)
 async def delete_channel_confirm_sub(callback: types.CallbackQuery):
     channel = callback.data.split(":", 1)[1]
-    if channel in CHANNELS:
-        CHANNELS.remove(channel)
+    if await remove_channel("sub", channel):
+        forget_channel(channel)
         await callback.message.edit_text(f"✅ {channel} (majburiy obuna) o‘chirildi.")
     else:
         await callback.message.edit_text("⚠️ Bu kanal topilmadi.")
     await callback.answer()
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("delmain:"), user_id=ADMINS)
+@router.callback("delmain:", admin_only=True)
 async def delete_channel_confirm_main(callback: types.CallbackQuery):
     channel = callback.data.split(":", 1)[1]
-    if channel in MAIN_CHANNELS:
-        MAIN_CHANNELS.remove(channel)
+    if await remove_channel("main", channel):
+        forget_channel(channel)
         await callback.message.edit_text(f"✅ {channel} (asosiy kanal) o‘chirildi.")
     else:
         await callback.message.edit_text("⚠️ Bu kanal topilmadi.")
@@ -372,66 +388,61 @@ async def delete_channel_confirm_main(callback: types.CallbackQuery):
 
 
 # === 📋 KANAL RO‘YXATI ===
-@dp.message_handler(lambda m: m.text == "📋 Kanal ro‘yxati", user_id=ADMINS)
+@router.text("📋 Kanal ro‘yxati", admin_only=True)
 async def list_channels(message: types.Message):
-    if not CHANNELS:
+    if not get_channels("sub"):
         await message.answer("📭 Hozircha hech qanday kanal yo‘q.")
         return
     text = "📋 Majburiy obuna kanallari:\n\n"
-    for i, ch in enumerate(CHANNELS, 1):
+    for i, ch in enumerate(get_channels("sub"), 1):
         text += f"{i}. {ch}\n"
     await message.answer(text)
 
 
 # === ❌ KANAL O‘CHIRISH ===
-@dp.message_handler(lambda m: m.text == "❌ Kanal o‘chirish", user_id=ADMINS)
+@router.text("❌ Kanal o‘chirish", admin_only=True)
 async def delete_channel_start(message: types.Message):
-    if not CHANNELS:
+    if not get_channels("sub"):
         await message.answer("📭 Hozircha hech qanday kanal yo‘q.")
         return
     kb = InlineKeyboardMarkup()
-    for ch in CHANNELS:
+    for ch in get_channels("sub"):
         kb.add(InlineKeyboardButton(f"O‘chirish: {ch}", callback_data=f"delch:{ch}"))
     await message.answer("❌ Qaysi kanalni o‘chirmoqchisiz?", reply_markup=kb)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("delch:"), user_id=ADMINS)
-async def delete_channel_confirm(callback: types.CallbackQuery):
-    channel = callback.data.split(":", 1)[1]
-    if channel in CHANNELS:
-        CHANNELS.remove(channel)
-        await callback.message.edit_text(f"✅ {channel} o‘chirildi.")
-    else:
-        await callback.message.edit_text("⚠️ Bu kanal topilmadi.")
-    await callback.answer()
 # ⬅️ Orqaga qaytish (Admin panelga)
-@dp.message_handler(lambda m: m.text == "⬅️ Orqaga", user_id=ADMINS)
+@router.text("⬅️ Orqaga", admin_only=True)
 async def back_to_admin_menu(message: types.Message):
     await message.answer("🔙 Admin menyu:", reply_markup=admin_keyboard())
 
 # === 🎞 Barcha animelar tugmasi
-@dp.message_handler(lambda m: m.text == "🎞 Barcha animelar")
+@router.text("🎞 Barcha animelar")
 async def show_all_animes(message: types.Message):
-    kodlar = await get_all_codes()
-    if not kodlar:
+    page = await catalog_page()
+    if not page:
         await message.answer("⛔️ Hozircha animelar yoʻq.")
         return
+    text, markup = page
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
-    # Kodlarni raqam bo‘yicha tartiblash
-    kodlar = sorted(kodlar, key=lambda x: int(x["code"]))
-
-    # Har 100 tadan bo‘lib yuborish
-    chunk_size = 100
-    for i in range(0, len(kodlar), chunk_size):
-        chunk = kodlar[i:i + chunk_size]
-        text = "📄 *Barcha animelar:*\n\n"
-        for row in chunk:
-            text += f"`{row['code']}` – *{row['title']}*\n"
 
-        await message.answer(text, parse_mode="Markdown")
+# === Katalog sahifalari: bitta xabar tahrirlanadi
+@router.callback("catalog:")
+async def catalog_page_button(callback: types.CallbackQuery):
+    page = await catalog_page(int(callback.data.split(":")[1]))
+    if not page:
+        await callback.answer("⛔️ Bu sahifa endi mavjud emas.", show_alert=True)
+        return
+    text, markup = page
+    try:
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except MessageNotModified:
+        pass
+    await callback.answer()
 
 
 # === Admin bilan bog'lanish (foydalanuvchi) ===
-@dp.message_handler(lambda m: m.text == "✉️ Admin bilan bog‘lanish")
+@router.text("✉️ Admin bilan bog‘lanish")
 async def contact_admin(message: types.Message):
     await UserStates.waiting_for_admin_message.set()
     await message.answer("✍️ Adminlarga yubormoqchi bo‘lgan xabaringizni yozing.\n\n📡 Bekor qilish uchun '📡 Boshqarish' tugmasini bosing.", reply_markup=control_keyboard())
@@ -447,7 +458,7 @@ async def forward_to_admins(message: types.Message, state: FSMContext):
     await state.finish()
     user = message.from_user
 
-    for admin_id in ADMINS:
+    for admin_id in get_admins():
         try:
             keyboard = InlineKeyboardMarkup().add(
                 InlineKeyboardButton("✉️ Javob yozish", callback_data=f"reply_user:{user.id}")
@@ -466,7 +477,7 @@ async def forward_to_admins(message: types.Message, state: FSMContext):
 
     await message.answer("✅ Xabaringiz yuborildi. Tez orada admin siz bilan bog‘lanadi.")
 
-@dp.callback_query_handler(lambda c: c.data.startswith("reply_user:"), user_id=ADMINS)
+@router.callback("reply_user:", admin_only=True)
 async def start_admin_reply(callback: CallbackQuery, state: FSMContext):
     user_id = int(callback.data.split(":")[1])
     await state.update_data(reply_user_id=user_id)
@@ -474,7 +485,7 @@ async def start_admin_reply(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer("✍️ Endi foydalanuvchiga yubormoqchi bo‘lgan xabaringizni yozing.", reply_markup=control_keyboard())
     await callback.answer()
 
-@dp.message_handler(state=AdminReplyStates.waiting_for_reply_message, user_id=ADMINS)
+@dp.message_handler(state=AdminReplyStates.waiting_for_reply_message, is_admin=True)
 async def send_admin_reply(message: types.Message, state: FSMContext):
     # agar boshqarish bosilgan bo'lsa
     if message.text == "📡 Boshqarish":
@@ -494,7 +505,7 @@ async def send_admin_reply(message: types.Message, state: FSMContext):
         await state.finish()
 
 # === 📡 Adminlar boshqaruvi ===
-@dp.message_handler(lambda m: m.text == "👮‍♂️ Adminlar", user_id=ADMINS)
+@router.text("👮‍♂️ Adminlar", admin_only=True)
 async def manage_admins(message: types.Message):
     kb = InlineKeyboardMarkup()
     kb.add(
@@ -507,7 +518,7 @@ async def manage_admins(message: types.Message):
 
 
 # === Adminlar callback handleri ===
-@dp.callback_query_handler(lambda c: c.data.startswith("admin_action:"), user_id=ADMINS)
+@router.callback("admin_action:", admin_only=True)
 async def admin_actions(callback: types.CallbackQuery, state: FSMContext):
     action = callback.data.split(":")[1]
 
@@ -516,22 +527,22 @@ async def admin_actions(callback: types.CallbackQuery, state: FSMContext):
         await callback.message.answer("🆔 Yangi adminning Telegram ID raqamini yuboring.", reply_markup=control_keyboard())
 
     elif action == "list":
-        if not ADMINS:
+        if not get_admins():
             await callback.message.answer("📭 Hozircha admin yo‘q.")
         else:
             text = "📋 Adminlar ro‘yxati:\n\n"
-            for i, admin_id in enumerate(ADMINS, 1):
+            for i, admin_id in enumerate(sorted(get_admins()), 1):
                 text += f"{i}. <code>{admin_id}</code>\n"
             await callback.message.answer(text, parse_mode="HTML")
 
     elif action == "delete":
-        if not ADMINS:
+        if not get_admins():
             await callback.message.answer("📭 Hozircha admin yo‘q.")
             await callback.answer()
             return
 
         kb = InlineKeyboardMarkup()
-        for admin_id in ADMINS:
+        for admin_id in sorted(get_admins()):
             # Siz o'zingizni o'chirib bo'lmaydi
             if admin_id == callback.from_user.id:
                 continue
@@ -549,7 +560,7 @@ async def admin_actions(callback: types.CallbackQuery, state: FSMContext):
 
 
 # === Adminni o‘chirish callback handleri ===
-@dp.callback_query_handler(lambda c: c.data.startswith("deladmin:"), user_id=ADMINS)
+@router.callback("deladmin:", admin_only=True)
 async def delete_admin_confirm(callback: types.CallbackQuery):
     admin_id = int(callback.data.split(":")[1])
     # Sizni o'chirib bo'lmaydi
@@ -557,8 +568,7 @@ async def delete_admin_confirm(callback: types.CallbackQuery):
         await callback.answer("❌ Sizni o‘chirib bo‘lmaydi!", show_alert=True)
         return
 
-    if admin_id in ADMINS:
-        ADMINS.remove(admin_id)
+    if await remove_admin(admin_id):
         await callback.message.edit_text(f"✅ Admin {admin_id} o‘chirildi.")
     else:
         await callback.message.edit_text("⚠️ Admin topilmadi.")
@@ -567,20 +577,8 @@ async def delete_admin_confirm(callback: types.CallbackQuery):
 
 
 
-# === Admin o‘chirish callback ===
-@dp.callback_query_handler(lambda c: c.data.startswith("deladmin:"), user_id=ADMINS)
-async def delete_admin(callback: types.CallbackQuery):
-    admin_id = int(callback.data.split(":", 1)[1])
-    if admin_id in ADMINS:
-        ADMINS.remove(admin_id)
-        await callback.message.edit_text(f"✅ Admin <code>{admin_id}</code> o‘chirildi.", parse_mode="HTML")
-    else:
-        await callback.message.edit_text("⚠️ Bu admin topilmadi.")
-    await callback.answer()
-
-
 # === Admin qo‘shish handleri ===
-@dp.message_handler(state=AdminStates.waiting_for_admin_id, user_id=ADMINS)
+@dp.message_handler(state=AdminStates.waiting_for_admin_id, is_admin=True)
 async def add_admin_process(message: types.Message, state: FSMContext):
     if message.text == "📡 Boshqarish":
         await state.finish()
@@ -595,11 +593,10 @@ async def add_admin_process(message: types.Message, state: FSMContext):
         return
 
     new_admin_id = int(text)
-    if new_admin_id in ADMINS:
+    if not await add_admin(new_admin_id):
         await message.answer("ℹ️ Bu foydalanuvchi allaqachon admin.")
         return
 
-    ADMINS.add(new_admin_id)
     await message.answer(f"✅ <code>{new_admin_id}</code> admin sifatida qo‘shildi.", parse_mode="HTML", reply_markup=admin_keyboard())
 
     try:
@@ -608,9 +605,9 @@ async def add_admin_process(message: types.Message, state: FSMContext):
         await message.answer("⚠️ Yangi adminga habar yuborib bo‘lmadi.")
 
 # === Kod statistikasi
-@dp.message_handler(lambda m: m.text == "📈 Kod statistikasi")
+@router.text("📈 Kod statistikasi")
 async def ask_stat_code(message: types.Message):
-    if message.from_user.id not in ADMINS:
+    if not is_admin(message.from_user.id):
         return
     await message.answer("📥 Kod raqamini yuboring:", reply_markup=control_keyboard())
     await AdminStates.waiting_for_stat_code.set()
@@ -640,13 +637,13 @@ async def show_code_stat(message: types.Message, state: FSMContext):
     )
 
 # --- Kodni tahrirlash boshlash ---
-@dp.message_handler(lambda message: message.text == "✏️ Kodni tahrirlash", user_id=ADMINS)
+@router.text("✏️ Kodni tahrirlash", admin_only=True)
 async def edit_code_start(message: types.Message):
     await message.answer("Qaysi kodni tahrirlashni xohlaysiz? (eski kodni yuboring)", reply_markup=control_keyboard())
     await EditCode.WaitingForOldCode.set()
 
 # --- Eski kodni qabul qilish ---
-@dp.message_handler(state=EditCode.WaitingForOldCode, user_id=ADMINS)
+@dp.message_handler(state=EditCode.WaitingForOldCode, is_admin=True)
 async def get_old_code(message: types.Message, state: FSMContext):
     if message.text == "📡 Boshqarish":
         await state.finish()
@@ -664,7 +661,7 @@ async def get_old_code(message: types.Message, state: FSMContext):
     await EditCode.WaitingForNewCode.set()
 
 # --- Yangi kodni olish ---
-@dp.message_handler(state=EditCode.WaitingForNewCode, user_id=ADMINS)
+@dp.message_handler(state=EditCode.WaitingForNewCode, is_admin=True)
 async def get_new_code(message: types.Message, state: FSMContext):
     if message.text == "📡 Boshqarish":
         await state.finish()
@@ -677,7 +674,7 @@ async def get_new_code(message: types.Message, state: FSMContext):
     await EditCode.WaitingForNewTitle.set()
 
 # --- Yangi nomni olish va yangilash ---
-@dp.message_handler(state=EditCode.WaitingForNewTitle, user_id=ADMINS)
+@dp.message_handler(state=EditCode.WaitingForNewTitle, is_admin=True)
 async def get_new_title(message: types.Message, state: FSMContext):
     if message.text == "📡 Boshqarish":
         await state.finish()
@@ -698,23 +695,24 @@ async def get_new_title(message: types.Message, state: FSMContext):
         await state.finish()
 
 # === Oddiy raqam yuborilganda
-@dp.message_handler(lambda message: message.text.isdigit())
+@router.digits()
 async def handle_code_message(message: types.Message):
     code = message.text
-    if not await is_user_subscribed(message.from_user.id):
-        markup = await make_subscribe_markup(code)
+    unsubscribed = await get_unsubscribed_channels(message.from_user.id)
+    if unsubscribed:
+        markup = await make_subscribe_markup(code, unsubscribed)
         await message.answer("❗ Kino olishdan oldin quyidagi kanal(lar)ga obuna bo‘ling:", reply_markup=markup)
     else:
         await increment_stat(code, "init")
         await increment_stat(code, "searched")
         await send_reklama_post(message.from_user.id, code)
 
-@dp.message_handler(lambda m: m.text == "📢 Habar yuborish")
+@router.text("📢 Habar yuborish")
 async def ask_broadcast_info(message: types.Message):
-    if message.from_user.id not in ADMINS:
+    if not is_admin(message.from_user.id):
         return
     await AdminStates.waiting_for_broadcast_data.set()
-    await message.answer("📨 Habar yuborish uchun format:\n`@kanal xabar_id`", parse_mode="Markdown", reply_markup=control_keyboard())
+    await message.answer("📨 Habar yuborish uchun format:\n`@kanal xabar_id` (forward)\n`@kanal xabar_id copy` (nusxa)\n\nBloklaganlarga ham yuborish uchun oxiriga `all` qo‘shing.", parse_mode="Markdown", reply_markup=control_keyboard())
 
 @dp.message_handler(state=AdminStates.waiting_for_broadcast_data)
 async def send_forward_only(message: types.Message, state: FSMContext):
@@ -725,44 +723,53 @@ async def send_forward_only(message: types.Message, state: FSMContext):
 
     await state.finish()
     parts = message.text.strip().split()
-    if len(parts) != 2:
-        await message.answer("❗ Format noto‘g‘ri. Masalan: `@kanalim 123`", reply_markup=admin_keyboard())
+    flags = set(parts[2:])
+    if len(parts) < 2 or not flags <= {"forward", "copy", "all"}:
+        await message.answer("❗ Format noto‘g‘ri. Masalan: `@kanalim 123` yoki `@kanalim 123 copy`", reply_markup=admin_keyboard())
         return
 
-    channel_username, msg_id = parts
+    channel_username, msg_id = parts[0], parts[1]
     if not msg_id.isdigit():
         await message.answer("❗ Xabar ID raqam bo‘lishi kerak.", reply_markup=admin_keyboard())
         return
+    mode = "copy" if "copy" in flags else "forward"
+    include_inactive = "all" in flags
 
     msg_id = int(msg_id)
-    users = await get_all_user_ids()
+    total = await get_user_count() if include_inactive else await get_active_user_count()
 
-    success = 0
-    fail = 0
-
-    for i, user_id in enumerate(users, start=1):
-        try:
-            await bot.forward_message(
-                chat_id=user_id,
-                from_chat_id=channel_username,
-                message_id=msg_id
-            )
-            success += 1
-        except RetryAfter as e:
-            print(f"Flood limit. Kutyapmiz {e.timeout} sekund...")
-            await asyncio.sleep(e.timeout)
-            continue
-        except (BotBlocked, ChatNotFound):
-            fail += 1
-        except Exception as e:
-            print(f"Xatolik {user_id}: {e}")
-            fail += 1
-
-        # Har 25 xabardan keyin 1 sekund kutish
-        if i % 25 == 0:
-            await asyncio.sleep(1)
+    job_id = await create_broadcast_job(message.chat.id, channel_username, msg_id, mode, total, include_inactive)
+    status_message = await message.answer(
+        BroadcastStats(total=total).format(), reply_markup=job_markup(job_id, "running")
+    )
+    await set_broadcast_status_message(job_id, status_message.message_id)
+    asyncio.create_task(run_broadcast_job(bot, job_id))
+    await message.answer(f"🚀 Habar yuborish #{job_id} boshlandi.", reply_markup=admin_keyboard())
+
+# === Broadcast jobini boshqarish (pauza / davom / bekor) ===
+@router.callback("bcast:", admin_only=True)
+async def broadcast_job_control(callback: types.CallbackQuery):
+    _, action, job_id = callback.data.split(":")
+    job_id = int(job_id)
+
+    if action == "pause":
+        changed = await set_broadcast_status(job_id, "paused")
+        stop_broadcast_job(job_id)
+    elif action == "cancel":
+        changed = await set_broadcast_status(job_id, "cancelled")
+        stop_broadcast_job(job_id)
+    elif action == "resume":
+        changed = await set_broadcast_status(job_id, "running")
+        if changed:
+            asyncio.create_task(run_broadcast_job(bot, job_id))
+            await callback.message.edit_reply_markup(job_markup(job_id, "running"))
+    else:
+        changed = False
 
-    await message.answer(f"✅ Yuborildi: {success} ta\n❌ Xatolik: {fail} ta", reply_markup=admin_keyboard())
+    if changed:
+        await callback.answer("✅ Bajarildi.")
+    else:
+        await callback.answer("⚠️ Bu job allaqachon tugagan.", show_alert=True)
 
 # === Reklama postni yuborish
 async def send_reklama_post(user_id, code):
@@ -773,9 +780,7 @@ async def send_reklama_post(user_id, code):
 
     channel, reklama_id, post_count = data["channel"], data["message_id"], data["post_count"]
 
-    buttons = [InlineKeyboardButton(str(i), callback_data=f"kino:{code}:{i}") for i in range(1, post_count + 1)]
-    keyboard = InlineKeyboardMarkup(row_width=5)
-    keyboard.add(*buttons)
+    keyboard = episode_keyboard(code, post_count)
 
     try:
         await bot.copy_message(user_id, channel, reklama_id - 1, reply_markup=keyboard)
@@ -784,7 +789,7 @@ async def send_reklama_post(user_id, code):
         await bot.send_message(user_id, "❌ Reklama postni yuborib bo‘lmadi.")
 
 # === Tugma orqali kino yuborish
-@dp.callback_query_handler(lambda c: c.data.startswith("kino:"))
+@router.callback("kino:")
 async def kino_button(callback: types.CallbackQuery):
     _, code, number = callback.data.split(":")
     number = int(number)
@@ -803,10 +808,50 @@ async def kino_button(callback: types.CallbackQuery):
     await bot.copy_message(callback.from_user.id, channel, base_id + number - 1)
     await callback.answer()
 
+# === Qismlar sahifasini almashtirish (xabar o‘rnida tahrirlanadi)
+@router.callback("kpage:")
+async def kino_page_button(callback: types.CallbackQuery):
+    _, code, page = callback.data.split(":")
+
+    result = await get_kino_by_code(code)
+    if not result:
+        await callback.answer("❌ Kod topilmadi.", show_alert=True)
+        return
+
+    try:
+        await callback.message.edit_reply_markup(episode_keyboard(code, result["post_count"], int(page)))
+    except MessageNotModified:
+        pass
+    await callback.answer()
+
+# === Bir nechta qismni bittada yuborish (oraliq yoki hammasi)
+@router.callback("kinor:")
+async def kino_range_button(callback: types.CallbackQuery):
+    _, code, first, last = callback.data.split(":")
+    first, last = int(first), int(last)
+
+    result = await get_kino_by_code(code)
+    if not result:
+        await callback.message.answer("❌ Kod topilmadi.")
+        return
+
+    channel, base_id, post_count = result["channel"], result["message_id"], result["post_count"]
+    last = min(last, post_count)
+    if first < 1 or first > last:
+        await callback.answer("❌ Bunday post yo‘q!", show_alert=True)
+        return
+
+    await callback.answer(f"⏳ {first}–{last} qismlar yuborilmoqda...")
+    try:
+        await send_episodes(bot, callback.from_user.id, channel, base_id, first, last)
+    except Exception as e:
+        print(f"[kino_range] {code} {first}-{last} -> {e}")
+        await callback.message.answer("⚠️ Qismlarni yuborishda muammo bo‘ldi. Keyinroq urinib ko‘ring.")
+
 # === ➕ Anime qo‘shish bosqichlari ===
-@dp.message_handler(lambda m: m.text == "➕ Anime qo‘shish")
+@router.text("➕ Anime qo‘shish")
 async def add_anime_start(message: types.Message):
-    if message.from_user.id in ADMINS:
+    if is_admin(message.from_user.id):
         await AdminStates.waiting_for_name.set()
         await message.answer("📝 Anime nomini kiriting:")
 
@@ -894,9 +939,9 @@ async def anime_video(message: types.Message, state: FSMContext):
     )
     await state.finish()
 # ➕ Anime yuborish boshlash
-@dp.message_handler(lambda m: m.text == "📤 Animeni yuborish")
+@router.text("📤 Animeni yuborish")
 async def send_anime_start(message: types.Message):
-    if message.from_user.id in ADMINS:
+    if is_admin(message.from_user.id):
         await AdminStates.waiting_for_anime_code.set()
         await message.answer("📝 Qaysi animeni yubormoqchisiz? Kodini kiriting:", reply_markup=control_keyboard())
 
@@ -934,7 +979,7 @@ async def send_anime_handler(message: types.Message, state: FSMContext):
     # Asosiy kanallarga yuborish
     successful = 0
     failed = 0
-    for ch in MAIN_CHANNELS:
+    for ch in get_channels("main"):
         try:
             await bot.send_video(
                 chat_id=ch,
@@ -952,28 +997,17 @@ async def send_anime_handler(message: types.Message, state: FSMContext):
     await state.finish()
 
 # === Kodlar ro‘yxat
-@dp.message_handler(lambda m: m.text == "📄 Kodlar ro‘yxati")
-async def show_all_animes(message: types.Message):
-    kodlar = await get_all_codes()
-    if not kodlar:
+@router.text("📄 Kodlar ro‘yxati")
+async def show_code_list(message: types.Message):
+    page = await catalog_page()
+    if not page:
         await message.answer("Ba'zada hech qanday kodlar yo'q!")
         return
-
-    # Kodlarni raqam bo‘yicha tartiblash
-    kodlar = sorted(kodlar, key=lambda x: int(x["code"]))
-
-    # Har 100 tadan bo‘lib yuborish
-    chunk_size = 100
-    for i in range(0, len(kodlar), chunk_size):
-        chunk = kodlar[i:i + chunk_size]
-        text = "📄 *Barcha animelar:*\n\n"
-        for row in chunk:
-            text += f"`{row['code']}` – *{row['title']}*\n"
-
-        await message.answer(text, parse_mode="Markdown")
+    text, markup = page
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
 # 📊 Statistika
-@dp.message_handler(lambda m: m.text == "📊 Statistika")
+@router.text("📊 Statistika", admin_only=True)
 async def stats(message: types.Message):
     # ⏱ Pingni o'lchash
     from database import db_pool
@@ -983,25 +1017,67 @@ async def stats(message: types.Message):
         ping = (time.perf_counter() - start) * 1000  # ms ga aylantiramiz
 
     # 📂 Kodlar va foydalanuvchilar soni
-    kodlar = await get_all_codes()
+    kodlar_soni = await get_kino_count()
     foydalanuvchilar = await get_user_count()
+    faol = await get_active_user_count()
 
     # 📅 Bugun qo'shilgan foydalanuvchilar
     today_users = await get_today_users()
 
+    # 🧠 Keshlar
+    sub_cache = membership_stats()
+    kino_cache = kino_cache_stats()
+    limiter = bot.limiter.stats()
+
     # 📊 Xabar
     text = (
         f"💡 O'rtacha yuklanish: {ping:.2f} ms\n\n"
-        f"👥 Umumiy foydalanuvchilar: {foydalanuvchilar} ta\n\n"
-        f"📂 Barcha yuklangan animelar: {len(kodlar)} ta\n\n"
-        f"📅 Bugun qo'shilgan foydalanuvchilar: {today_users} ta"
+        f"👥 Umumiy foydalanuvchilar: {foydalanuvchilar} ta\n"
+        f"🟢 Faol foydalanuvchilar: {faol} ta\n\n"
+        f"📂 Barcha yuklangan animelar: {kodlar_soni} ta\n\n"
+        f"📅 Bugun qo'shilgan foydalanuvchilar: {today_users} ta\n\n"
+        f"🧠 Obuna keshi: {sub_cache['hits']} hit / {sub_cache['misses']} miss ({sub_cache['hit_rate']:.0%})\n"
+        f"🎬 Kod keshi: {kino_cache['hits']} hit / {kino_cache['misses']} miss ({kino_cache['hit_rate']:.0%})\n\n"
+        f"📤 Yuborilgan so‘rovlar: {limiter['sent']} ta (429: {limiter['retry_after']} ta)\n"
+        f"⏳ Navbatda: global {limiter['global_waiting']} / chatlar {limiter['chat_waiting']} "
+        f"(⏸ {limiter['paused_chats']} ta chat to‘xtatilgan)\n"
+        f"🚦 p99 kechikish: interaktiv {limiter['p99_ms']['interactive']:.0f} ms / "
+        f"admin {limiter['p99_ms']['admin']:.0f} ms / ommaviy {limiter['p99_ms']['bulk']:.0f} ms\n"
+        f"📥 Ommaviy navbat: {limiter['waiting']['bulk']} ta"
     )
     await message.answer(text)
 
+# 🧹 Kod keshini tozalash
+@dp.message_handler(commands=["flush_cache"], is_admin=True)
+async def flush_kino_cache(message: types.Message):
+    kino_cache = kino_cache_stats()
+    clear_kino_cache()
+    await message.answer(
+        f"🧹 Kod keshi tozalandi.\n"
+        f"📦 Yozuvlar: {kino_cache['size']} ta\n"
+        f"🎯 Hit-rate: {kino_cache['hit_rate']:.0%} ({kino_cache['hits']} / {kino_cache['hits'] + kino_cache['misses']})"
+    )
+
+# 📄 Eksport: foydalanuvchilar va katalog bitta CSV hujjat sifatida
+@dp.message_handler(commands=["export_users"], is_admin=True)
+async def export_users(message: types.Message):
+    version = await get_users_version()
+    await send_export(
+        bot, message.chat.id, "users", version, "foydalanuvchilar.csv",
+        ("user_id", "status", "created_at"), iter_user_rows, caption="👥 Foydalanuvchilar"
+    )
+
+@dp.message_handler(commands=["export_catalog"], is_admin=True)
+async def export_catalog(message: types.Message):
+    await send_export(
+        bot, message.chat.id, "catalog", catalog_version(), "katalog.csv",
+        ("code", "title", "post_count", "status", "voice", "genres"), iter_catalog, caption="🎞 Animelar katalogi"
+    )
+
 # === POST QILISH: rasm yoki video (60s) + universal boshqarish tugmasi ===
-@dp.message_handler(lambda m: m.text == "📤 Post qilish")
+@router.text("📤 Post qilish")
 async def start_post_process(message: types.Message):
-    if message.from_user.id in ADMINS:
+    if is_admin(message.from_user.id):
         await PostStates.waiting_for_image.set()
         await message.answer("🖼 Iltimos, post uchun rasm yoki video yuboring (video 60 sekunddan oshmasin).", reply_markup=control_keyboard())
         
@@ -1079,9 +1155,9 @@ async def get_post_link(message: types.Message, state: FSMContext):
         await state.finish()
 
 # === Kod o'chirish ===
-@dp.message_handler(lambda m: m.text == "❌ Kodni o‘chirish")
+@router.text("❌ Kodni o‘chirish")
 async def ask_delete_code(message: types.Message):
-    if message.from_user.id in ADMINS:
+    if is_admin(message.from_user.id):
         await AdminStates.waiting_for_delete_code.set()
         await message.answer("🗑 Qaysi kodni o‘chirmoqchisiz? Kodni yuboring.", reply_markup=control_keyboard())
 
@@ -1111,9 +1187,52 @@ async def control_action(message: types.Message, state: FSMContext):
 
 # === on_startup va run ===
 async def on_startup(dp):
-    await init_db()
-    register_konkurs_handlers(dp, bot, ADMINS)
+    # Ko‘p jarayonli rejimda sxema front jarayonda (run_workers -> migrate_db) yaratilgan
+    await init_db(migrate=BOT_WORKERS <= 1)
+    register_konkurs_handlers(dp, bot, router)
+    await warm_channel_meta(bot, get_channels("sub"))
+    asyncio.create_task(channel_meta_refresher(bot, lambda: get_channels("sub")))
+    if is_primary_worker():
+        await migrate_legacy_files()
+        await resume_broadcast_jobs(bot)
+        asyncio.create_task(fsm_cleanup_loop(storage))
     print("✅ PostgreSQL bazaga ulandi!")
 
+async def on_shutdown(dp):
+    await close_db()
+
+# === Polling rejimi: health endpoint shu loop'da ===
+health_runner = None
+
+async def on_startup_polling(dp):
+    global health_runner
+    health_runner = await start_health_server(port=PORT)
+    await on_startup(dp)
+
+async def on_shutdown_polling(dp):
+    await on_shutdown(dp)
+    if health_runner:
+        await health_runner.cleanup()
+
+# === Webhook rejimi ===
+async def on_startup_webhook(dp):
+    await on_startup(dp)
+    await bot.set_webhook(
+        WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH,
+        allowed_updates=ALLOWED_UPDATES,
+        drop_pending_updates=True,
+        max_connections=min(WEBHOOK_CONCURRENCY, 100),
+        secret_token=WEBHOOK_SECRET
+    )
+    print(f"✅ Webhook o‘rnatildi: {WEBHOOK_HOST}{WEBHOOK_PATH}")
+
 if __name__ == "__main__":
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    if BOT_WORKERS > 1:
+        webhook_url = WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH if WEBHOOK_HOST else None
+        run_workers(dp, BOT_WORKERS, on_startup, on_shutdown, ALLOWED_UPDATES,
+                    webhook_url=webhook_url, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, port=PORT,
+                    prepare=migrate_db)
+    elif WEBHOOK_HOST:
+        run_webhook(dp, WEBHOOK_PATH, on_startup_webhook, on_shutdown, port=PORT, secret=WEBHOOK_SECRET)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup_polling, on_shutdown=on_shutdown_polling, allowed_updates=ALLOWED_UPDATES)
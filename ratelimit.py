@@ -0,0 +1,280 @@
+import os
+import time
+import heapq
+import asyncio
+import functools
+import itertools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram import Bot, types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import RetryAfter
+
+# ==== TELEGRAM LIMITLARI ====
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "29"))         # butun bot bo‘yicha xabar/sekund (~30/s)
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))              # bitta shaxsiy chatga xabar/sekund
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))   # guruh/kanal: 20 ta/daqiqa
+TG_GROUP_BURST = float(os.getenv("TG_GROUP_BURST", "5"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))            # RetryAfter'dan keyin qayta urinishlar
+TG_CHAT_BUCKETS = int(os.getenv("TG_CHAT_BUCKETS", "10000"))      # shundan oshsa bo‘sh bucketlar tozalanadi
+TG_BULK_RESERVE = float(os.getenv("TG_BULK_RESERVE", "2"))        # ommaviy yuborish tegmaydigan tokenlar
+TG_LATENCY_WINDOW = int(os.getenv("TG_LATENCY_WINDOW", "1000"))   # p99 uchun oxirgi so‘rovlar soni
+
+# Faqat xabar yuboruvchi/o‘zgartiruvchi metodlar cheklanadi (getChatMember va h.k. emas)
+_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+
+# ==== USTUVORLIK ====
+INTERACTIVE = 0   # foydalanuvchiga javob (kod, qism, reklama posti)
+ADMIN = 1         # admin panel amallari
+BULK = 2          # broadcast, konkurs e'lonlari - faqat bo‘sh qolgan tezlik
+PRIORITY_NAMES = {INTERACTIVE: "interactive", ADMIN: "admin", BULK: "bulk"}
+
+current_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Blok ichidagi (va undan yaratilgan task'lardagi) barcha yuborishlar shu ustuvorlikda"""
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+def bulk(func):
+    """Async funksiyani BULK ustuvorlikda bajaradi (e'lonlar, ommaviy DM'lar)"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with send_priority(BULK):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+# ==== TOKEN BUCKET ====
+class TokenBucket:
+    """Sekundiga `rate` ta ruxsat beradi; RetryAfter kelganda butunlay to‘xtatib turiladi"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.waiting = 0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._updated = self._paused_until
+        self._tokens = 0
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+    def idle(self) -> bool:
+        """Kutayotganlar yo‘q va bucket to‘lgan - uni o‘chirib yuborsa bo‘ladi"""
+        now = time.monotonic()
+        if self.waiting or now < self._paused_until:
+            return False
+        return self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self._paused_until:
+                        await asyncio.sleep(self._paused_until - now)
+                        continue
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+
+# ==== USTUVORLIKLI BUCKET ====
+class PriorityBucket(TokenBucket):
+    """Navbatdagilar ustuvorlik bo‘yicha xizmat qilinadi (bir xil ustuvorlikda - kelish tartibida).
+    BULK so‘rovlar `reserve` tokenni qoldiradi, shuning uchun interaktiv javob deyarli kutmaydi."""
+
+    def __init__(self, rate: float, capacity: float = None, reserve: float = TG_BULK_RESERVE):
+        super().__init__(rate, capacity)
+        self.reserve = reserve
+        self.waiting_by_priority = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._heap = []
+        self._seq = itertools.count()
+        self._pump_task = None
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        self.waiting += 1
+        self.waiting_by_priority[priority] += 1
+        if self._pump_task is None:
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            await future
+        finally:
+            self.waiting -= 1
+            self.waiting_by_priority[priority] -= 1
+
+    async def _pump(self):
+        try:
+            while self._heap:
+                priority, _, future = self._heap[0]
+                if future.done():  # bekor qilingan kutuvchi
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                need = 1 + (max(0, min(self.reserve, self.capacity - 1)) if priority == BULK else 0)
+                if self._tokens >= need:
+                    heapq.heappop(self._heap)
+                    self._tokens -= 1
+                    future.set_result(None)
+                    continue
+                await asyncio.sleep((need - self._tokens) / self.rate)
+        finally:
+            self._pump_task = None
+
+
+def _p99(samples) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+
+
+# ==== UMUMIY LIMITER ====
+def _chat_key(chat_id):
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id  # "@kanal"
+
+
+class RateLimiter:
+    """Global, har bir chat va guruh/kanal limitlari. Avval chat bucketi, keyin global bucket olinadi -
+    shunda bitta band chatni kutayotgan so‘rov global tezlikni band qilib turmaydi."""
+
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE):
+        self.global_rate = global_rate
+        self.global_bucket = PriorityBucket(global_rate)
+        self.chat_buckets = {}
+        self.sent = 0
+        self.retry_after = 0
+        self.latency = {p: deque(maxlen=TG_LATENCY_WINDOW) for p in PRIORITY_NAMES}  # sekund
+
+    def set_share(self, workers: int):
+        """Ko‘p jarayonli rejimda global limit worker'lar orasida teng bo‘linadi.
+        Sig‘im kamida 1 token - aks holda (ko‘p worker'da) bucket hech qachon so‘rov o‘tkazmaydi"""
+        share = self.global_rate / max(workers, 1)
+        self.global_bucket.rate = share
+        self.global_bucket.capacity = max(1.0, share)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= TG_CHAT_BUCKETS:
+                self._prune()
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(TG_GROUP_RATE, TG_GROUP_BURST) if is_group else TokenBucket(TG_CHAT_RATE, TG_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.idle()]:
+            del self.chat_buckets[chat_id]
+
+    async def acquire(self, chat_id=None, priority: int = None) -> float:
+        """Chat bucketidan o‘tgan vaqtni qaytaradi: undan keyingi kutish - umumiy navbat (ustuvorlik) ta'siri"""
+        if priority is None:
+            priority = current_priority.get()
+        if chat_id is not None:
+            await self._chat_bucket(_chat_key(chat_id)).acquire()
+        queued = time.monotonic()
+        await self.global_bucket.acquire(priority)
+        self.sent += 1
+        return queued
+
+    def record_latency(self, priority: int, seconds: float):
+        self.latency[priority].append(seconds)
+
+    def penalize(self, chat_id, seconds: float):
+        """RetryAfter: faqat tegishli bucket to‘xtatiladi (chatsiz metodlarda - global)"""
+        self.retry_after += 1
+        bucket = self._chat_bucket(_chat_key(chat_id)) if chat_id is not None else self.global_bucket
+        bucket.pause(seconds)
+
+    def stats(self) -> dict:
+        buckets = self.chat_buckets.values()
+        return {
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "global_waiting": self.global_bucket.waiting,
+            "chat_waiting": sum(b.waiting for b in buckets),
+            "chat_buckets": len(self.chat_buckets),
+            "paused_chats": sum(1 for b in buckets if b.paused),
+            "waiting": {PRIORITY_NAMES[p]: n for p, n in self.global_bucket.waiting_by_priority.items()},
+            "p99_ms": {PRIORITY_NAMES[p]: _p99(samples) * 1000 for p, samples in self.latency.items()},
+        }
+
+
+# ==== BOT ====
+class RateLimitedBot(Bot):
+    """Barcha chiquvchi xabarlar (send*/copy*/forward*/edit*) umumiy limiter orqali o‘tadi.
+    RetryAfter kelsa tegishli bucket to‘xtatiladi va so‘rov qayta yuboriladi."""
+
+    def __init__(self, *args, limiter: RateLimiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or RateLimiter()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        if not method.startswith(_LIMITED_PREFIXES):
+            return await super().request(method, data, files, **kwargs)
+        chat_id = (data or {}).get("chat_id")
+        priority = current_priority.get()
+        for attempt in range(TG_MAX_RETRIES + 1):
+            queued = await self.limiter.acquire(chat_id, priority)
+            try:
+                result = await super().request(method, data, files, **kwargs)
+                # Umumiy navbatda kutish + API javobi (chatning o‘z limiti hisobga olinmaydi)
+                self.limiter.record_latency(priority, time.monotonic() - queued)
+                return result
+            except RetryAfter as e:
+                print(f"[ratelimit] {method} chat={chat_id}: {e.timeout} sekund kutamiz...")
+                self.limiter.penalize(chat_id, e.timeout)
+                if attempt == TG_MAX_RETRIES:
+                    raise
+
+
+# ==== UPDATE USTUVORLIGI ====
+class PriorityMiddleware(BaseMiddleware):
+    """Har bir update handleri yuboradigan xabarlar ustuvorligini belgilaydi: admin - ADMIN, qolganlar - INTERACTIVE"""
+
+    def __init__(self, is_admin):
+        super().__init__()
+        self.is_admin = is_admin
+
+    def _apply(self, user: types.User):
+        current_priority.set(ADMIN if user and self.is_admin(user.id) else INTERACTIVE)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self._apply(message.from_user)
+
+    async def on_pre_process_callback_query(self, callback: types.CallbackQuery, data: dict):
+        self._apply(callback.from_user)
@@ -0,0 +1,106 @@
+import inspect
+
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters import BoundFilter
+
+from database import is_admin as _is_admin
+
+
+# === Admin filtri ===
+class AdminFilter(BoundFilter):
+    """`is_admin=True` - adminlar ro‘yxati import paytida emas, har bir update'da (xotiradan) tekshiriladi"""
+    key = "is_admin"
+
+    def __init__(self, is_admin: bool):
+        self.is_admin = is_admin
+
+    async def check(self, obj) -> bool:
+        return _is_admin(obj.from_user.id) == self.is_admin
+
+
+# === Marshrutlash jadvali ===
+class Router:
+    """Aniq matnli tugmalar va callback prefikslari uchun O(1) marshrutlash.
+    Har bir update uchun aiogram faqat ikkita filtrni tekshiradi, qolgani dict qidiruvi."""
+
+    def __init__(self, is_admin=None):
+        self.texts = {}       # "📊 Statistika" -> handler
+        self.prefixes = {}    # "kino:" -> handler
+        self.digit_handler = None
+        self.is_admin = is_admin or _is_admin
+        self._names = {}      # handler nomi -> kalit (takroriy funksiyalarni aniqlash uchun)
+
+    # --- Ro‘yxatdan o‘tkazish ---
+    def _entry(self, key, handler, admin_only: bool):
+        name = f"{handler.__module__}.{handler.__qualname__}"
+        if name in self._names:
+            raise ValueError(f"Handler nomi takrorlangan: {name} ({self._names[name]!r} va {key!r})")
+        self._names[name] = key
+        pass_state = "state" in inspect.signature(handler).parameters
+        return handler, admin_only, pass_state
+
+    def text(self, text: str, admin_only: bool = False):
+        def decorator(handler):
+            if text in self.texts:
+                raise ValueError(f"Tugma ikki marta ro‘yxatdan o‘tkazilgan: {text!r}")
+            self.texts[text] = self._entry(text, handler, admin_only)
+            return handler
+        return decorator
+
+    def callback(self, prefix: str, admin_only: bool = False):
+        if not prefix.endswith(":"):
+            raise ValueError(f"Callback prefiksi ':' bilan tugashi kerak: {prefix!r}")
+
+        def decorator(handler):
+            if prefix in self.prefixes:
+                raise ValueError(f"Callback prefiksi ikki marta ro‘yxatdan o‘tkazilgan: {prefix!r}")
+            self.prefixes[prefix] = self._entry(prefix, handler, admin_only)
+            return handler
+        return decorator
+
+    def digits(self, admin_only: bool = False):
+        def decorator(handler):
+            if self.digit_handler:
+                raise ValueError("Raqamli xabarlar handleri ikki marta ro‘yxatdan o‘tkazilgan")
+            self.digit_handler = self._entry("<digits>", handler, admin_only)
+            return handler
+        return decorator
+
+    # --- Qidiruv ---
+    def find_message(self, message: types.Message):
+        text = message.text
+        if not text:
+            return None
+        entry = self.texts.get(text)
+        if entry is None and self.digit_handler and text.isdigit():
+            entry = self.digit_handler
+        return entry
+
+    def find_callback(self, callback: types.CallbackQuery):
+        data = callback.data or ""
+        prefix, sep, _ = data.partition(":")
+        return self.prefixes.get(prefix + sep) if sep else None
+
+    # --- Dispatch ---
+    async def _call(self, entry, obj, state: FSMContext):
+        handler, admin_only, pass_state = entry
+        if admin_only and not self.is_admin(obj.from_user.id):
+            if isinstance(obj, types.CallbackQuery):
+                await obj.answer()
+            return
+        if pass_state:
+            return await handler(obj, state=state)
+        return await handler(obj)
+
+    def setup(self, dp):
+        router = self
+
+        async def route_message(message: types.Message, state: FSMContext):
+            return await router._call(router.find_message(message), message, state)
+
+        async def route_callback(callback: types.CallbackQuery, state: FSMContext):
+            return await router._call(router.find_callback(callback), callback, state)
+
+        dp.register_message_handler(route_message, lambda m: router.find_message(m) is not None)
+        dp.register_callback_query_handler(route_callback, lambda c: router.find_callback(c) is not None)
@@ -0,0 +1,176 @@
+import os
+import asyncio
+
+from cache import TTLCache
+
+# ==== SOZLAMALAR ====
+SUB_CACHE_TTL = float(os.getenv("SUB_CACHE_TTL", "300"))          # obuna bo‘lganlar uchun (sekund)
+SUB_CACHE_NEG_TTL = float(os.getenv("SUB_CACHE_NEG_TTL", "20"))   # obuna bo‘lmaganlar uchun (sekund)
+SUB_CACHE_SIZE = int(os.getenv("SUB_CACHE_SIZE", "100000"))
+
+SUB_CHECK_CONCURRENCY = int(os.getenv("SUB_CHECK_CONCURRENCY", "16"))  # bir vaqtdagi get_chat_member soni
+SUB_CHECK_TIMEOUT = float(os.getenv("SUB_CHECK_TIMEOUT", "3"))         # bitta chaqiruv uchun (sekund)
+SUB_CHECK_DEADLINE = float(os.getenv("SUB_CHECK_DEADLINE", "5"))       # butun tekshiruv uchun (sekund)
+# Deadline o‘tib ketsa: 1 -> obuna deb hisoblanadi (fail-open), 0 -> obuna emas (fail-closed)
+SUB_FAIL_OPEN = os.getenv("SUB_FAIL_OPEN", "0") == "1"
+
+CHANNEL_META_REFRESH = float(os.getenv("CHANNEL_META_REFRESH", "3600"))  # kanal ma'lumotlarini yangilash oralig‘i
+CHANNEL_META_NEG_TTL = float(os.getenv("CHANNEL_META_NEG_TTL", "300"))   # get_chat xato bergan kanal qayta so‘ralmaydi
+
+SUBSCRIBED_STATUSES = ("member", "administrator", "creator")
+
+# (kanal, user_id) -> True/False
+membership_cache = TTLCache(maxsize=SUB_CACHE_SIZE, ttl=SUB_CACHE_TTL)
+
+_check_semaphore = asyncio.Semaphore(SUB_CHECK_CONCURRENCY)
+
+# kanal -> {"chat_id", "title", "invite_link"}
+_channel_meta = {}
+
+# get_chat xato bergan kanallar (har bir obuna bo‘lmagan so‘rovda API qayta chaqirilmasligi uchun)
+_channel_meta_failed = TTLCache(maxsize=1000, ttl=CHANNEL_META_NEG_TTL)
+
+
+def normalize_channel(channel) -> str:
+    """'@AniLordTV ' va '@anilordtv' bitta kalitga tushishi uchun"""
+    return str(channel).strip().lower()
+
+
+def remember_membership(channel, user_id: int, subscribed: bool):
+    ttl = SUB_CACHE_TTL if subscribed else SUB_CACHE_NEG_TTL
+    membership_cache.set((normalize_channel(channel), user_id), subscribed, ttl=ttl)
+
+
+def forget_channel(channel):
+    """Kanal ro‘yxatdan olib tashlanganda uning barcha yozuvlarini tozalaydi"""
+    key = normalize_channel(channel)
+    _channel_meta.pop(key, None)
+    _channel_meta_failed.pop(key)
+    return membership_cache.drop_where(lambda k: k[0] == key)
+
+
+def membership_stats():
+    return membership_cache.stats()
+
+
+# ==== BITTA KANALNI TEKSHIRISH (kesh orqali) ====
+async def check_member(bot, channel, user_id: int) -> bool:
+    key = (normalize_channel(channel), user_id)
+    cached = membership_cache.get(key)
+    if cached is not None:
+        return cached
+    async with _check_semaphore:
+        member = await asyncio.wait_for(bot.get_chat_member(channel.strip(), user_id), SUB_CHECK_TIMEOUT)
+    subscribed = getattr(member, "status", None) in SUBSCRIBED_STATUSES
+    remember_membership(channel, user_id, subscribed)
+    return subscribed
+
+
+# ==== BARCHA KANALLARNI PARALLEL TEKSHIRISH ====
+async def get_unsubscribed(bot, channels, user_id: int) -> list:
+    """Obuna bo‘linmagan kanallar ro‘yxatini qaytaradi (kanallar parallel tekshiriladi)"""
+    channels = list(channels)
+    if not channels:
+        return []
+    tasks = [asyncio.ensure_future(check_member(bot, ch, user_id)) for ch in channels]
+    done, pending = await asyncio.wait(tasks, timeout=SUB_CHECK_DEADLINE)
+    for task in pending:
+        task.cancel()
+
+    unsubscribed = []
+    for channel, task in zip(channels, tasks):
+        if task in pending:
+            print(f"⏱ Obuna tekshiruvi deadline'dan o‘tdi: {channel}")
+            if not SUB_FAIL_OPEN:
+                unsubscribed.append(channel)
+            continue
+        error = task.exception()
+        if isinstance(error, asyncio.TimeoutError):
+            print(f"⏱ get_chat_member javob bermadi: {channel}")
+            if not SUB_FAIL_OPEN:
+                unsubscribed.append(channel)
+        elif error is not None:
+            print(f"❗ Obuna tekshirishda xatolik: {channel} -> {error}")
+            unsubscribed.append(channel)
+        elif not task.result():
+            unsubscribed.append(channel)
+    return unsubscribed
+
+
+# ==== chat_member UPDATE'LARI ====
+def apply_chat_member_update(update):
+    """Kanal a'zoligi o‘zgarganda keshni darhol yangilaydi (API chaqiruvsiz)"""
+    chat = update.chat
+    member = update.new_chat_member
+    user_id = member.user.id
+    subscribed = member.status in SUBSCRIBED_STATUSES
+    keys = [str(chat.id)]
+    if chat.username:
+        keys.append(f"@{chat.username}")
+    for key in keys:
+        remember_membership(key, user_id, subscribed)
+
+
+# ==== KANAL MA'LUMOTLARI (nomi, chat_id, doimiy havola) ====
+async def fetch_channel_meta(bot, channel) -> dict:
+    """Kanalni API'dan o‘qib saqlaydi. Havola faqat bir marta yaratiladi va qayta ishlatiladi"""
+    key = normalize_channel(channel)
+    chat = await bot.get_chat(channel.strip())
+    old = _channel_meta.get(key)
+    if chat.username:
+        invite_link = f"https://t.me/{chat.username}"
+    elif old and old["chat_id"] == chat.id and old["invite_link"]:
+        invite_link = old["invite_link"]
+    elif chat.invite_link:
+        invite_link = chat.invite_link
+    else:
+        link = await bot.create_chat_invite_link(chat.id, name="bot")
+        invite_link = link.invite_link
+    meta = {"chat_id": chat.id, "title": chat.title or channel, "invite_link": invite_link}
+    _channel_meta[key] = meta
+    _channel_meta_failed.pop(key)
+    return meta
+
+
+async def warm_channel_meta(bot, channels):
+    channels = list(channels)
+    results = await asyncio.gather(*(fetch_channel_meta(bot, ch) for ch in channels), return_exceptions=True)
+    for channel, result in zip(channels, results):
+        if isinstance(result, Exception):
+            print(f"❗ Kanal ma'lumotini olishda xatolik: {channel} -> {result}")
+            _channel_meta_failed.set(normalize_channel(channel), True)
+
+
+async def channel_meta_refresher(bot, get_channels):
+    """Fon vazifasi: kanal nomlari va havolalarini vaqti-vaqti bilan yangilab turadi"""
+    while True:
+        await asyncio.sleep(CHANNEL_META_REFRESH)
+        await warm_channel_meta(bot, get_channels())
+
+
+def _fallback_link(channel):
+    """Ma'lumot olinmagan '@kanal' uchun ham tugma chiqishi kerak"""
+    channel = str(channel).strip()
+    if channel.startswith("@"):
+        return f"https://t.me/{channel[1:]}"
+    return None
+
+
+async def get_channel_links(bot, channels) -> list:
+    """[(kanal, nomi, havola), ...] — odatda hech qanday API chaqiruvisiz"""
+    missing = [
+        ch for ch in channels
+        if normalize_channel(ch) not in _channel_meta and _channel_meta_failed.get(normalize_channel(ch)) is None
+    ]
+    if missing:
+        await warm_channel_meta(bot, missing)
+    links = []
+    for channel in channels:
+        meta = _channel_meta.get(normalize_channel(channel))
+        if meta:
+            links.append((channel, meta["title"], meta["invite_link"]))
+            continue
+        fallback = _fallback_link(channel)
+        if fallback:
+            links.append((channel, str(channel).strip(), fallback))
+    return links
@@ -0,0 +1,40 @@
+import asyncio
+
+import database
+import fsm_storage
+from fsm_storage import PgStorage
+
+
+class _Conn:
+    async def fetchrow(self, *args):
+        return None
+
+
+class _Acquire:
+    async def __aenter__(self):
+        return _Conn()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _Pool:
+    def acquire(self):
+        return _Acquire()
+
+
+def test_load_evicts_beyond_cache_size(monkeypatch):
+    monkeypatch.setattr(database, "db_pool", _Pool(), raising=False)
+    monkeypatch.setattr(fsm_storage, "FSM_CACHE_SIZE", 2)
+
+    async def scenario():
+        storage = PgStorage()
+        storage._dirty.add((1, 1))  # yozilmagan yozuv o‘chirilmasligi kerak
+        for user in range(1, 6):
+            await storage._load(user, user)
+        return storage
+
+    storage = asyncio.run(scenario())
+    assert len(storage._cache) == 2
+    assert (1, 1) in storage._cache
+    assert (5, 5) in storage._cache
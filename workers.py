@@ -0,0 +1,139 @@
+import os
+import signal
+import asyncio
+import multiprocessing
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from keep_alive import create_app, WebhookHandler, UpdateProcessor, close_dispatcher, update_user_id
+
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))  # 1 dan katta bo‘lsa ko‘p jarayonli rejim
+
+# Joriy jarayonning tartib raqami (front va yagona jarayonda 0)
+WORKER_INDEX = 0
+
+# Barcha worker'larga yuboriladigan update turlari (keshlarni yangilash uchun)
+_BROADCAST_FIELDS = ("chat_member", "my_chat_member")
+
+
+def is_primary_worker() -> bool:
+    """Fon vazifalari (broadcast joblarini davom ettirish va h.k.) faqat bitta worker'da ishlaydi"""
+    return WORKER_INDEX == 0
+
+
+# === Worker jarayoni ===
+async def _consume(dp: Dispatcher, queue, on_startup, on_shutdown):
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await on_startup(dp)
+    processor = UpdateProcessor(dp)
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+            break
+        processor.submit(data)
+    await processor.drain()
+    await on_shutdown(dp)
+    await close_dispatcher(dp)
+
+
+def _worker_main(dp, index, count, queue, on_startup, on_shutdown):
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    limiter = getattr(dp.bot, "limiter", None)
+    if limiter:
+        # Telegram global limiti bot token bo‘yicha - worker'lar uni bo‘lishib oladi
+        limiter.set_share(count)
+    # To‘xtash signalini front jarayon navbat orqali beradi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_consume(dp, queue, on_startup, on_shutdown))
+
+
+# === Front jarayon: update'larni worker'larga taqsimlash ===
+class WorkerPool:
+    def __init__(self, dp: Dispatcher, count: int, on_startup, on_shutdown):
+        # Fork event loop va bot sessiyasi yaratilishidan oldin bajariladi
+        ctx = multiprocessing.get_context("fork")
+        self.queues = [ctx.Queue() for _ in range(count)]
+        self.processes = [
+            ctx.Process(target=_worker_main, args=(dp, i, count, q, on_startup, on_shutdown), name=f"bot-worker-{i}")
+            for i, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        print(f"✅ {len(self.processes)} ta worker ishga tushdi")
+
+    def submit(self, data: dict):
+        """Har bir foydalanuvchi doim bitta worker'ga tushadi (FSM tartibi saqlanadi)"""
+        if any(field in data for field in _BROADCAST_FIELDS):
+            for queue in self.queues:
+                queue.put_nowait(data)
+            return
+        self.queues[update_user_id(data) % len(self.queues)].put_nowait(data)
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join()
+
+
+async def poll_updates(bot: Bot, sink, allowed_updates):
+    """Webhook'siz rejim: front jarayon getUpdates orqali o‘qib worker'larga tarqatadi"""
+    await bot.delete_webhook(drop_pending_updates=True)
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=20, allowed_updates=allowed_updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[poll] {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            sink(update.to_python())
+
+
+def run_workers(dp: Dispatcher, count: int, on_startup, on_shutdown, allowed_updates,
+                webhook_url=None, path="/webhook", secret=None, host="0.0.0.0", port=8080, prepare=None):
+    if prepare:
+        # Sxema (CREATE/ALTER ... IF NOT EXISTS) parallel bajarilsa Postgres'da ham to‘qnashishi mumkin -
+        # shuning uchun fork'dan oldin front jarayonda bir marta, o‘z event loop'ida bajariladi
+        asyncio.run(prepare())
+    pool = WorkerPool(dp, count, on_startup, on_shutdown)
+    pool.start()
+
+    app = create_app()
+    if webhook_url:
+        app.router.add_post(path, WebhookHandler(pool.submit, secret))
+    tasks = {}
+
+    async def _startup(app):
+        if webhook_url:
+            await dp.bot.set_webhook(
+                webhook_url,
+                allowed_updates=allowed_updates,
+                drop_pending_updates=True,
+                max_connections=100,
+                secret_token=secret
+            )
+        else:
+            tasks["poller"] = asyncio.create_task(poll_updates(dp.bot, pool.submit, allowed_updates))
+
+    async def _shutdown(app):
+        poller = tasks.get("poller")
+        if poller:
+            poller.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, pool.stop)
+        session = await dp.bot.get_session()
+        await session.close()
+
+    app.on_startup.append(_startup)
+    app.on_shutdown.append(_shutdown)
+    web.run_app(app, host=host, port=port)